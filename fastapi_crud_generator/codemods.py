@@ -141,8 +141,10 @@ class _DepsTransformer(cst.CSTTransformer):
             func_src = (
                 f"def {self.spec.func_name}(\n"
                 f"    storage: AbstractSQLAlchemyStorage = Depends(get_storage),\n"
+                f"    session: AsyncSession = Depends(get_session),\n"
+                f"    read_session: AsyncSession = Depends(get_read_session),\n"
                 f") -> {self.spec.import_name}:\n"
-                f"    return {self.spec.import_name}(storage)\n"
+                f"    return {self.spec.import_name}(storage, session, read_session)\n"
             )
             func_stmt = cst.parse_statement(func_src)
 
@@ -0,0 +1,93 @@
+"""
+Compare the encode and decode throughput of the token codecs per backend and algorithm.
+Combinations a backend does not support are reported as skipped.
+
+    SETTINGS_PATH=settings.yaml python scripts/benchmark_token_codecs.py [--seconds 1]
+"""
+
+import argparse
+import secrets
+import sys
+import time
+from pathlib import Path
+
+# add parent dir to sys.path
+sys.path.append(str(Path(__file__).parents[1]))
+from src.api.auth.util import TokenCodec, create_token_codec  # noqa: E402
+
+BACKENDS = ("jose", "hmac")
+ALGORITHMS = ("HS256", "RS256", "EdDSA")
+
+
+def _keys(algorithm: str) -> tuple[str, str | None]:
+    if algorithm.startswith("HS"):
+        return secrets.token_urlsafe(32), None
+    try:
+        from cryptography.hazmat.primitives.asymmetric import ed25519, rsa  # noqa: PLC0415
+        from cryptography.hazmat.primitives.serialization import (  # noqa: PLC0415
+            Encoding,
+            NoEncryption,
+            PrivateFormat,
+            PublicFormat,
+        )
+    except ImportError as e:
+        raise ValueError("key generation requires the `eddsa` extra") from e
+    if algorithm.startswith("RS"):
+        private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        return (
+            private_key.private_bytes(Encoding.PEM, PrivateFormat.PKCS8, NoEncryption()).decode(),
+            private_key.public_key().public_bytes(Encoding.PEM, PublicFormat.SubjectPublicKeyInfo).decode(),
+        )
+    if algorithm == "EdDSA":
+        private_key = ed25519.Ed25519PrivateKey.generate()
+        return private_key.private_bytes(Encoding.PEM, PrivateFormat.PKCS8, NoEncryption()).decode(), None
+    raise ValueError(f"no key generator for {algorithm}")
+
+
+def _throughput(func, seconds: float) -> float:
+    calls = 0
+    started_at = time.perf_counter()
+    deadline = started_at + seconds
+    while (now := time.perf_counter()) < deadline:
+        for _ in range(100):
+            func()
+        calls += 100
+    return calls / (now - started_at)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--seconds", type=float, default=1.0, help="Duration of each measurement")
+    args = parser.parse_args()
+
+    now = int(time.time())
+    claims = {"sub": "42", "type": "access", "iat": now, "exp": now + 3600, "token_version": 0, "scope": "admin"}
+
+    print(f"{'backend':<8} {'algorithm':<10} {'codec':<16} {'encode/s':>12} {'decode/s':>12}")
+    for algorithm in ALGORITHMS:
+        measured: set[type[TokenCodec]] = set()
+        try:
+            signing_key, verification_key = _keys(algorithm)
+        except ValueError as e:
+            for backend in BACKENDS:
+                print(f"{backend:<8} {algorithm:<10} skipped: {e}")
+            continue
+        for backend in BACKENDS:
+            try:
+                codec: TokenCodec = create_token_codec(backend, algorithm, signing_key, verification_key)
+                token = codec.encode(claims)
+                codec.decode(token)
+            except Exception as e:
+                print(f"{backend:<8} {algorithm:<10} skipped: {e}")
+                continue
+            if type(codec) in measured:
+                # Both backends share the only implementation of the algorithm
+                continue
+            measured.add(type(codec))
+            encode = _throughput(lambda: codec.encode(claims), args.seconds)
+            decode = _throughput(lambda: codec.decode(token), args.seconds)
+            print(f"{backend:<8} {algorithm:<10} {type(codec).__name__:<16} {encode:>12,.0f} {decode:>12,.0f}")
+
+
+if __name__ == "__main__":
+    main()
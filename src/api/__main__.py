@@ -9,13 +9,15 @@ if not os.getenv("SKIP_PREPARE"):
 
 import uvicorn  # noqa: E402
 
+from src.config import api_settings  # noqa: E402
+
 # Get arguments from command
 args = sys.argv[1:]
 extended_args = [
     "src.api.app:app",
     "--use-colors",
     "--proxy-headers",
-    "--forwarded-allow-ips=*",
+    f"--forwarded-allow-ips={','.join(api_settings.trusted_proxies)}",
     *args,
 ]
 
@@ -5,6 +5,7 @@ from fastapi_swagger import patch_fastapi
 
 import src.api.logging_  # noqa: F401
 from src.api.lifespan import lifespan
+from src.api.rate_limit import RateLimitMiddleware
 from src.config import api_settings
 
 app = FastAPI(
@@ -14,6 +15,8 @@ app.router.route_class = AutoDeriveResponsesAPIRoute
 
 patch_fastapi(app)
 
+# Added before CORS so that it runs inside it, and 429 responses still carry the CORS headers
+app.add_middleware(RateLimitMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origin_regex=api_settings.cors_allow_origin_regex,
@@ -23,7 +26,11 @@ app.add_middleware(
 )
 
 from src.api.auth.routes import router as auth_router  # noqa: E402
+from src.api.metrics.routes import router as metrics_router  # noqa: E402
 from src.api.user.routes import router as user_router  # noqa: E402
+from src.api.well_known.routes import router as well_known_router  # noqa: E402
 
 app.include_router(auth_router)
 app.include_router(user_router)
+app.include_router(metrics_router)
+app.include_router(well_known_router)
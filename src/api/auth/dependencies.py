@@ -1,27 +1,80 @@
+from dataclasses import dataclass
 from typing import Annotated
 
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 
 from src.api.auth.util import decode_token
-from src.api.repositories.dependencies import get_user_repository
+from src.api.repositories.dependencies import get_shared_user_loader
+from src.cache import TTLCache
+from src.config import auth_settings
+from src.db.loader import BatchLoader
 from src.db.models import User
-from src.db.repositories import UserRepository
+from src.schemas.auth import TokenPayload
 
 bearer_scheme = HTTPBearer(scheme_name="Bearer", auto_error=True)
 
+principal_cache = TTLCache[int, User](
+    User.__tablename__,
+    maxsize=auth_settings.principal_cache_size,
+    ttl=auth_settings.principal_cache_ttl_seconds,
+)
+"Authenticated users by id, invalidated by `UserRepository` writes"
+
+
+@dataclass(frozen=True, slots=True)
+class Principal:
+    """
+    Identity and role of the caller, for endpoints that do not need the whole user.
+    """
+
+    id: int
+    is_admin: bool
+    token_version: int
+
+    @classmethod
+    def from_claims(cls, token_payload: TokenPayload) -> "Principal":
+        return cls(
+            id=int(token_payload.sub),
+            is_admin="admin" in (token_payload.scope or "").split(),
+            token_version=token_payload.token_version,
+        )
+
+    @classmethod
+    def from_user(cls, user: User) -> "Principal":
+        return cls(id=user.id, is_admin=user.is_admin, token_version=user.token_version)
+
+
+async def _load_user(token_payload: TokenPayload, user_loader: BatchLoader[int, User]) -> User:
+    # Misses of concurrent requests are loaded with one query, outside of any request session, so the cached user
+    # can be shared
+    user_id = int(token_payload.sub)
+    user = await principal_cache.get_or_load(user_id, lambda: user_loader.load(user_id))
+    if not user or user.token_version != token_payload.token_version:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+
+    return user
+
 
 async def get_current_user(
     creds: Annotated[HTTPAuthorizationCredentials, Depends(bearer_scheme)],
-    user_repository: UserRepository = Depends(get_user_repository),
+    user_loader: BatchLoader[int, User] = Depends(get_shared_user_loader),
 ) -> User:
     token_payload = decode_token(creds.credentials, expected_type="access")
+    return await _load_user(token_payload, user_loader)
 
-    user = await user_repository.get_user(int(token_payload.sub))
-    if not user:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
 
-    return user
+async def get_principal(
+    creds: Annotated[HTTPAuthorizationCredentials, Depends(bearer_scheme)],
+    user_loader: BatchLoader[int, User] = Depends(get_shared_user_loader),
+) -> Principal:
+    """
+    The caller, built from the verified token claims alone in stateless mode, from the current user otherwise.
+    """
+    token_payload = decode_token(creds.credentials, expected_type="access")
+    if auth_settings.stateless_principal:
+        return Principal.from_claims(token_payload)
+    return Principal.from_user(await _load_user(token_payload, user_loader))
 
 
 async def require_admin(current_user: Annotated[User, Depends(get_current_user)]) -> User:
@@ -29,3 +82,10 @@ async def require_admin(current_user: Annotated[User, Depends(get_current_user)]
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin only")
 
     return current_user
+
+
+async def require_admin_principal(principal: Annotated[Principal, Depends(get_principal)]) -> Principal:
+    if not principal.is_admin:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin only")
+
+    return principal
@@ -0,0 +1,185 @@
+__all__ = ["DEFAULT_ROUNDS", "PasswordHasher", "password_hasher"]
+
+import asyncio
+import functools
+import math
+import os
+import time
+from collections.abc import Callable
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Literal
+
+import bcrypt
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+
+from src import metrics
+from src.config import auth_settings
+
+_WAIT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+DEFAULT_ROUNDS = 12
+"bcrypt cost used until the hasher is calibrated"
+
+
+# Module-level functions, so that they can be sent to worker processes along with the rounds
+
+
+@functools.cache
+def _context(rounds: int) -> CryptContext:
+    # Hashes below the current cost are reported as outdated and upgraded on the next login
+    return CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__default_rounds=rounds, bcrypt__min_rounds=rounds)
+
+
+def _hash(password: str, rounds: int) -> str:
+    return _context(rounds).hash(password)
+
+
+def _verify_and_update(password: str, hashed_password: str, rounds: int) -> tuple[bool, str | None]:
+    return _context(rounds).verify_and_update(password, hashed_password)
+
+
+def _measure(rounds: int) -> float:
+    started_at = time.perf_counter()
+    bcrypt.hashpw(b"calibration", bcrypt.gensalt(rounds))
+    return time.perf_counter() - started_at
+
+
+class PasswordHasher:
+    """
+    Async facade of the password `CryptContext`. bcrypt takes hundreds of milliseconds per call, so hashing runs
+    on a dedicated pool instead of blocking the event loop. bcrypt releases the GIL, so threads are enough unless
+    the event loop itself is CPU-bound; processes are started on first use.
+
+    At most `max_concurrency` jobs run at once and at most `max_queue` wait for a slot, further requests are
+    rejected with 503 right away instead of piling up latency for everyone. Batch jobs are never rejected, but at
+    most `max_batch_concurrency` of them run or wait for a slot at once, so that a large batch does not queue up
+    in front of logins.
+    """
+
+    executor_type: Literal["thread", "process"]
+    workers: int
+    rounds: int
+    "bcrypt cost of new hashes, stored ones with a lower cost are rehashed on login"
+    max_concurrency: int
+    max_queue: int
+    max_batch_concurrency: int
+
+    def __init__(
+        self,
+        executor_type: Literal["thread", "process"] = "thread",
+        workers: int | None = None,
+        max_concurrency: int | None = None,
+        max_queue: int = 64,
+        rounds: int = DEFAULT_ROUNDS,
+        max_batch_concurrency: int | None = None,
+    ) -> None:
+        self.executor_type = executor_type
+        self.rounds = rounds
+        self.workers = workers or os.cpu_count() or 1
+        self.max_concurrency = max_concurrency or self.workers
+        self.max_queue = max_queue
+        self.max_batch_concurrency = max_batch_concurrency or max(1, self.max_concurrency // 2)
+        self._executor: Executor | None = None
+        self._slots = asyncio.Semaphore(self.max_concurrency)
+        self._batch_slots = asyncio.Semaphore(self.max_batch_concurrency)
+        self._queued = 0
+        "Jobs waiting for a slot that count against `max_queue`"
+        self._waiting = 0
+        self._running = 0
+        self._average_duration = 0.25
+        "Moving average of the job duration in seconds, to estimate when to retry"
+
+        self.wait_seconds = metrics.histogram(
+            "password_hashing.wait_seconds", _WAIT_BUCKETS, "Time jobs spent waiting for a slot"
+        )
+        self.rejected = metrics.counter("password_hashing.rejected", "Jobs rejected because the queue was full")
+        metrics.gauge("password_hashing.queue_depth", lambda: self._waiting, "Jobs waiting for a slot")
+        metrics.gauge("password_hashing.running", lambda: self._running, "Jobs being hashed")
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            if self.executor_type == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="password-hasher")
+        return self._executor
+
+    async def hash(self, password: str, bounded: bool = True) -> str:
+        """
+        Hash the password. Unbounded jobs wait for a slot however long the queue is, for batch operations that
+        should be slowed down rather than rejected; they are limited by `max_batch_concurrency` instead.
+        """
+        return await self._run(_hash, password, self.rounds, bounded=bounded)
+
+    async def verify_and_update(self, password: str, hashed_password: str) -> tuple[bool, str | None]:
+        """
+        Check the password, returning a new hash as well if the stored one uses outdated parameters.
+        """
+        return await self._run(_verify_and_update, password, hashed_password, self.rounds)
+
+    async def calibrate(self, target_seconds: float, min_rounds: int, max_rounds: int = 16) -> int:
+        """
+        Pick the highest bcrypt cost whose hashes take at most `target_seconds` on this machine, but at least
+        `min_rounds`. Every extra round doubles the time, so one measurement at `min_rounds` is enough.
+        """
+        elapsed = await asyncio.get_running_loop().run_in_executor(self.executor, _measure, min_rounds)
+        extra_rounds = math.floor(math.log2(target_seconds / elapsed)) if elapsed < target_seconds else 0
+        self.rounds = min(max(min_rounds + extra_rounds, min_rounds), max_rounds)
+        self._average_duration = elapsed * 2 ** (self.rounds - min_rounds)
+        return self.rounds
+
+    async def _run[T](self, func: Callable[..., T], *args: Any, bounded: bool = True) -> T:
+        if not bounded:
+            async with self._batch_slots:
+                return await self._run_in_slot(func, *args, bounded=False)
+
+        if self._slots.locked() and self._queued >= self.max_queue:
+            self.rejected.inc()
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many concurrent authentication requests",
+                headers={"Retry-After": str(self._retry_after())},
+            )
+        return await self._run_in_slot(func, *args, bounded=True)
+
+    async def _run_in_slot[T](self, func: Callable[..., T], *args: Any, bounded: bool) -> T:
+        self._waiting += 1
+        self._queued += bounded
+        enqueued_at = time.perf_counter()
+        try:
+            await self._slots.acquire()
+        finally:
+            self._waiting -= 1
+            self._queued -= bounded
+        started_at = time.perf_counter()
+        self.wait_seconds.observe(started_at - enqueued_at)
+
+        self._running += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+        finally:
+            self._running -= 1
+            self._slots.release()
+            self._average_duration += 0.1 * (time.perf_counter() - started_at - self._average_duration)
+
+    def _retry_after(self) -> int:
+        """
+        Seconds until the jobs queued now are expected to be done.
+        """
+        return max(1, math.ceil((self._waiting / self.max_concurrency + 1) * self._average_duration))
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+password_hasher = PasswordHasher(
+    auth_settings.password_hashing_executor,
+    auth_settings.password_hashing_workers,
+    max_concurrency=auth_settings.password_hashing_max_concurrency,
+    max_queue=auth_settings.password_hashing_max_queue,
+    rounds=auth_settings.password_hash_rounds or DEFAULT_ROUNDS,
+)
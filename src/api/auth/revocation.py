@@ -0,0 +1,124 @@
+__all__ = ["BloomFilter", "RevocationSet", "cleanup_refresh_tokens", "revoked_families"]
+
+import asyncio
+import hashlib
+import math
+import time
+
+from src import metrics
+from src.api.auth.util import REFRESH_TTL
+from src.api.logging_ import logger
+from src.config import auth_settings
+from src.db import AbstractSQLAlchemyStorage
+from src.db.repositories import RefreshTokenRepository
+
+
+class BloomFilter:
+    """
+    Set membership in a fixed number of bits: no false negatives, and false positives at about `error_rate` as long
+    as at most `capacity` keys were added. Keys cannot be removed, the filter is rebuilt instead.
+    """
+
+    capacity: int
+    error_rate: float
+
+    def __init__(self, capacity: int, error_rate: float) -> None:
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self._size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self._hashes = max(1, round(self._size / capacity * math.log(2)))
+        self._bits = bytearray((self._size + 7) // 8)
+
+    def _positions(self, key: str) -> list[int]:
+        # Double hashing, two 64 bit halves of one digest stand in for `_hashes` independent hash functions
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8]), int.from_bytes(digest[8:]) | 1
+        return [(first + i * second) % self._size for i in range(self._hashes)]
+
+    def add(self, key: str) -> None:
+        for position in self._positions(key):
+            self._bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key: str) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class RevocationSet:
+    """
+    Keys revoked in this process or loaded on startup, each remembered for `ttl` seconds, after which the tokens
+    carrying it have expired anyway. Lookups of keys that were never revoked, nearly all of them, are answered by
+    the Bloom filter; the exact set rules out its false positives.
+    """
+
+    name: str
+    ttl: float
+
+    def __init__(self, name: str, ttl: float, capacity: int, error_rate: float) -> None:
+        self.name = name
+        self.ttl = ttl
+        self._revoked: dict[str, float] = {}
+        self._filter = BloomFilter(capacity, error_rate)
+
+        self.false_positives = metrics.counter(
+            f"revocation.{name}.false_positives", "Lookups the Bloom filter could not rule out, of keys not revoked"
+        )
+        metrics.gauge(f"revocation.{name}.size", lambda: len(self._revoked), "Number of revoked keys")
+
+    def add(self, key: str) -> None:
+        self._revoked[key] = time.monotonic() + self.ttl
+        if len(self._revoked) > self._filter.capacity:
+            self._rebuild(2 * len(self._revoked))
+        else:
+            self._filter.add(key)
+
+    def __contains__(self, key: str) -> bool:
+        if key not in self._filter:
+            return False
+        expires_at = self._revoked.get(key)
+        if expires_at is None or expires_at <= time.monotonic():
+            self.false_positives.inc()
+            return False
+        return True
+
+    def prune(self) -> None:
+        """
+        Forget the expired keys, the filter is rebuilt so that they stop matching.
+        """
+        now = time.monotonic()
+        self._revoked = {key: expires_at for key, expires_at in self._revoked.items() if expires_at > now}
+        self._rebuild(self._filter.capacity)
+
+    def _rebuild(self, capacity: int) -> None:
+        self._filter = BloomFilter(max(capacity, len(self._revoked)), self._filter.error_rate)
+        for key in self._revoked:
+            self._filter.add(key)
+
+
+revoked_families = RevocationSet(
+    "refresh_token_family",
+    ttl=REFRESH_TTL.total_seconds(),
+    capacity=auth_settings.revocation_filter_capacity,
+    error_rate=auth_settings.revocation_filter_error_rate,
+)
+"Revoked refresh token families, checked before the database on refresh"
+
+
+async def cleanup_refresh_tokens(storage: AbstractSQLAlchemyStorage, interval: float, batch_size: int) -> None:
+    """
+    Every `interval` seconds, delete the expired refresh tokens `batch_size` at a time, each batch in its own
+    transaction, and forget the expired revocations.
+    """
+    repository = RefreshTokenRepository(storage)
+    while True:
+        await asyncio.sleep(interval)
+        deleted = 0
+        try:
+            while (batch := await repository.delete_expired_refresh_tokens(batch_size)) > 0:
+                deleted += batch
+                if batch < batch_size:
+                    break
+        except Exception:
+            logger.exception("Failed to delete expired refresh tokens")
+        if deleted:
+            logger.info(f"Deleted {deleted} expired refresh tokens")
+        revoked_families.prune()
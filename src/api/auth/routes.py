@@ -1,101 +1,155 @@
+import uuid
+from datetime import UTC, datetime
 from typing import Annotated
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, status
+from fastapi.responses import JSONResponse
 from fastapi_derive_responses import AutoDeriveResponsesAPIRoute
-from passlib.context import CryptContext
 
+from src import metrics
 from src.api.auth.dependencies import get_current_user
+from src.api.auth.passwords import password_hasher
+from src.api.auth.revocation import revoked_families
 from src.api.auth.util import ACCESS_TTL, REFRESH_TTL, create_access_token, create_refresh_token, decode_token
-from src.api.repositories.dependencies import get_user_repository
+from src.api.logging_ import logger
+from src.api.repositories.dependencies import get_refresh_token_repository, get_storage, get_user_repository
+from src.db.errors import UniqueViolationError
 from src.db.models import User
-from src.db.repositories import UserRepository
+from src.db.repositories import RefreshTokenRepository, UserRepository
+from src.db.storage import AbstractSQLAlchemyStorage
 from src.schemas import LoginRequest, RefreshTokenRequest, RegisterRequest, TokenResponse, UserResponse
 
 router = APIRouter(prefix="/auth", tags=["Authentication"], route_class=AutoDeriveResponsesAPIRoute)
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+refresh_token_reuse = metrics.counter(
+    "refresh_token.reuse_detected", "Refresh tokens presented again after rotation, their families were revoked"
+)
+
+
+def _token_response(user: User, jti: str, family_id: str) -> TokenResponse:
+    scope = "admin" if user.is_admin else None
+    return TokenResponse(
+        access_token=create_access_token(subject=str(user.id), scope=scope, token_version=user.token_version),
+        refresh_token=create_refresh_token(
+            subject=str(user.id), jti=jti, family_id=family_id, token_version=user.token_version
+        ),
+        expires_in=int(ACCESS_TTL.total_seconds()),
+        refresh_expires_in=int(REFRESH_TTL.total_seconds()),
+    )
+
+
+async def _start_token_family(user: User, refresh_token_repository: RefreshTokenRepository) -> TokenResponse:
+    jti, family_id = uuid.uuid4().hex, uuid.uuid4().hex
+    await refresh_token_repository.create_refresh_token(jti, family_id, user.id, datetime.now(UTC) + REFRESH_TTL)
+    return _token_response(user, jti, family_id)
+
+
+async def _revoke_if_reused(refresh_token_repository: RefreshTokenRepository, jti: str) -> bool:
+    """
+    Revoke the family of a token that was already exchanged: either the client or an attacker holds a copy,
+    and there is no telling which. Returns whether the family was revoked.
+    """
+    refresh_token = await refresh_token_repository.get_refresh_token(jti)
+    if refresh_token is None or refresh_token.used_at is None or refresh_token.revoked:
+        return False
+    await refresh_token_repository.revoke_refresh_token_family(refresh_token.family_id)
+    revoked_families.add(refresh_token.family_id)
+    refresh_token_reuse.inc()
+    logger.warning(f"Refresh token reuse detected for user {refresh_token.user_id}, revoked its token family")
+    return True
 
 
 @router.post("/register", status_code=status.HTTP_201_CREATED)
 async def register(
     payload: RegisterRequest,
     user_repository: UserRepository = Depends(get_user_repository),
+    refresh_token_repository: RefreshTokenRepository = Depends(get_refresh_token_repository),
 ) -> TokenResponse:
-    existing_email = await user_repository.get_user_by_email(str(payload.email))
-    if existing_email:
-        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Email already in use")
-
-    existing_username = await user_repository.get_user_by_username(str(payload.username))
-    if existing_username:
-        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Username already in use")
-
-    hashed = pwd_context.hash(payload.password)
-    user = await user_repository.create_user(
-        name=payload.name,
-        username=payload.username,
-        email=str(payload.email),
-        hashed_password=hashed,
-    )
-
-    scope = "admin" if user.is_admin else None
-    access_token = create_access_token(subject=str(user.id), scope=scope)
-    refresh_token = create_refresh_token(subject=str(user.id))
+    hashed = await password_hasher.hash(payload.password)
+    try:
+        user = await user_repository.create_user(
+            name=payload.name,
+            username=payload.username,
+            email=str(payload.email),
+            hashed_password=hashed,
+        )
+    except UniqueViolationError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"{e.field.capitalize()} already in use")
 
-    return TokenResponse(
-        access_token=access_token,
-        refresh_token=refresh_token,
-        expires_in=int(ACCESS_TTL.total_seconds()),
-        refresh_expires_in=int(REFRESH_TTL.total_seconds()),
-    )
+    return await _start_token_family(user, refresh_token_repository)
 
 
 @router.post("/token")
 async def login(
     credentials: LoginRequest,
+    background_tasks: BackgroundTasks,
+    storage: AbstractSQLAlchemyStorage = Depends(get_storage),
     user_repository: UserRepository = Depends(get_user_repository),
+    refresh_token_repository: RefreshTokenRepository = Depends(get_refresh_token_repository),
 ) -> TokenResponse:
     user = await user_repository.get_user_by_username(credentials.username)
     if not user:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials", headers={"WWW-Authenticate": "Bearer"})
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
 
-    verified, new_hash = pwd_context.verify_and_update(credentials.password, user.hashed_password)
+    verified, new_hash = await password_hasher.verify_and_update(credentials.password, user.hashed_password)
     if not verified:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials", headers={"WWW-Authenticate": "Bearer"})
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
     if new_hash:
-        await user_repository.edit_user(user.id, hashed_password=new_hash)
+        # Upgrade the outdated hash after the response is sent, in a session of its own
+        background_tasks.add_task(UserRepository(storage).edit_user, user.id, hashed_password=new_hash)
 
-    scope = "admin" if user.is_admin else None
-    access_token = create_access_token(subject=str(user.id), scope=scope)
-    refresh_token = create_refresh_token(subject=str(user.id))
-
-    return TokenResponse(
-        access_token=access_token,
-        refresh_token=refresh_token,
-        expires_in=int(ACCESS_TTL.total_seconds()),
-        refresh_expires_in=int(REFRESH_TTL.total_seconds()),
-    )
+    return await _start_token_family(user, refresh_token_repository)
 
 
 @router.post("/refresh")
 async def refresh_token(
     request: RefreshTokenRequest,
     user_repository: UserRepository = Depends(get_user_repository),
+    refresh_token_repository: RefreshTokenRepository = Depends(get_refresh_token_repository),
 ) -> TokenResponse:
     payload = decode_token(request.refresh_token, expected_type="refresh")
+    invalid_token = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token", headers={"WWW-Authenticate": "Bearer"}
+    )
+    if payload.jti is None or payload.fam is None or payload.fam in revoked_families:
+        raise invalid_token
+
+    new_jti = uuid.uuid4().hex
+    rotated = await refresh_token_repository.rotate_refresh_token(payload.jti, new_jti, datetime.now(UTC) + REFRESH_TTL)
+    if rotated is None:
+        if await _revoke_if_reused(refresh_token_repository, payload.jti):
+            # Returned rather than raised, so that the request transaction commits the revocation
+            return JSONResponse(
+                {"detail": invalid_token.detail}, status_code=invalid_token.status_code, headers=invalid_token.headers
+            )
+        raise invalid_token
+
     user = await user_repository.get_user(int(payload.sub))
-    if not user:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token", headers={"WWW-Authenticate": "Bearer"})
+    if not user or user.token_version != payload.token_version:
+        raise invalid_token
+    return _token_response(user, new_jti, rotated.family_id)
 
-    scope = "admin" if user.is_admin else None
-    new_access = create_access_token(subject=str(user.id), scope=scope)
-    new_refresh = create_refresh_token(subject=str(user.id))
 
-    return TokenResponse(
-        access_token=new_access,
-        refresh_token=new_refresh,
-        expires_in=int(ACCESS_TTL.total_seconds()),
-        refresh_expires_in=int(REFRESH_TTL.total_seconds()),
-    )
+@router.post("/revoke", status_code=status.HTTP_204_NO_CONTENT)
+async def revoke_token(
+    request: RefreshTokenRequest,
+    refresh_token_repository: RefreshTokenRepository = Depends(get_refresh_token_repository),
+) -> None:
+    """
+    Revoke the refresh token along with every token rotated from the same login, e.g. on logout.
+    """
+    payload = decode_token(request.refresh_token, expected_type="refresh")
+    if payload.fam is not None:
+        await refresh_token_repository.revoke_refresh_token_family(payload.fam)
+        revoked_families.add(payload.fam)
 
 
 @router.get("/me")
@@ -1,15 +1,328 @@
+import base64
+import hashlib
+import hmac
+import json
+import time
+from abc import ABC, abstractmethod
+from collections.abc import Sequence
 from datetime import UTC, datetime, timedelta
+from typing import Any, Literal
 
 from fastapi import HTTPException, status
-from jose import ExpiredSignatureError, JWTError, jwt
+from jose import ExpiredSignatureError, JWTError, jwk, jwt
 from jose.exceptions import JWTClaimsError
 
+from src.cache import TTLCache
 from src.config import api_settings, auth_settings
 from src.schemas.auth import TokenPayload, TokenType
 
+
+class TokenCodec(ABC):
+    """
+    Signs claims into a JWT and verifies them back. Key material is prepared once when the codec is created instead
+    of on every call. `decode` raises the `jose` exceptions whichever backend is used.
+    """
+
+    algorithm: str
+    kid: str | None = None
+    "Key id sent in the `kid` header, for verifiers to pick the key"
+
+    @abstractmethod
+    def encode(self, claims: dict[str, Any]) -> str: ...
+
+    @abstractmethod
+    def decode(self, token: str) -> dict[str, Any]:
+        """
+        Verify the signature and the `exp`, `iat` and `nbf` claims, `exp` and `iat` are required.
+        """
+
+    def jwks(self) -> list[dict[str, Any]]:
+        """
+        Public keys tokens are verified with, as JWKs. Empty for symmetric algorithms, whose key must stay secret.
+        """
+        return []
+
+    def _headers(self) -> dict[str, Any] | None:
+        return {"kid": self.kid} if self.kid is not None else None
+
+
+class JoseTokenCodec(TokenCodec):
+    """
+    `python-jose` codec, for every algorithm it supports. Asymmetric keys without a private key only verify.
+    """
+
+    def __init__(
+        self,
+        algorithm: str,
+        signing_key: str | None,
+        verification_key: str | None = None,
+        leeway: int = 0,
+        kid: str | None = None,
+    ) -> None:
+        self.algorithm = algorithm
+        self.leeway = leeway
+        self.kid = kid
+        self._signing_key = jwk.construct(signing_key, algorithm) if signing_key is not None else None
+        if verification_key is not None:
+            self._verification_key = jwk.construct(verification_key, algorithm)
+        elif self._signing_key is not None:
+            self._verification_key = self._signing_key if algorithm.startswith("HS") else self._signing_key.public_key()
+        else:
+            raise ValueError("A signing or verification key is required")
+
+    def encode(self, claims: dict[str, Any]) -> str:
+        if self._signing_key is None:
+            raise RuntimeError(f"Key {self.kid} has no private key to sign with")
+        return jwt.encode(claims, self._signing_key, algorithm=self.algorithm, headers=self._headers())
+
+    def decode(self, token: str) -> dict[str, Any]:
+        return jwt.decode(
+            token,
+            self._verification_key,
+            algorithms=[self.algorithm],
+            options={"require_exp": True, "require_iat": True, "leeway": self.leeway},
+        )
+
+    def jwks(self) -> list[dict[str, Any]]:
+        if self.algorithm.startswith("HS"):
+            return []
+        return [{**self._verification_key.to_dict(), "kid": self.kid, "use": "sig"}]
+
+
+def _b64encode(data: bytes) -> bytes:
+    return base64.urlsafe_b64encode(data).rstrip(b"=")
+
+
+def _b64decode(data: bytes) -> bytes:
+    return base64.urlsafe_b64decode(data + b"=" * (-len(data) % 4))
+
+
+class _CompactTokenCodec(TokenCodec):
+    """
+    Codec doing the JWT serialization and claims validation itself, around the signature of a subclass.
+    The header is always the same, so it is encoded once.
+    """
+
+    def __init__(self, algorithm: str, leeway: int = 0, kid: str | None = None) -> None:
+        self.algorithm = algorithm
+        self.leeway = leeway
+        self.kid = kid
+        header = {"alg": algorithm, "typ": "JWT", **(self._headers() or {})}
+        self._header = _b64encode(json.dumps(header, separators=(",", ":"), sort_keys=True).encode())
+
+    @abstractmethod
+    def _sign(self, signing_input: bytes) -> bytes: ...
+
+    @abstractmethod
+    def _verify(self, signing_input: bytes, signature: bytes) -> bool: ...
+
+    def encode(self, claims: dict[str, Any]) -> str:
+        signing_input = self._header + b"." + _b64encode(json.dumps(claims, separators=(",", ":")).encode())
+        return (signing_input + b"." + _b64encode(self._sign(signing_input))).decode()
+
+    def decode(self, token: str) -> dict[str, Any]:
+        try:
+            signing_input, signature = token.encode().rsplit(b".", 1)
+            header, payload = signing_input.split(b".")
+            if signing_input.startswith(self._header + b"."):
+                alg = self.algorithm
+            else:
+                alg = json.loads(_b64decode(header)).get("alg")
+            signature = _b64decode(signature)
+            claims = json.loads(_b64decode(payload))
+        except (ValueError, AttributeError) as e:
+            raise JWTError("Invalid token") from e
+        if alg != self.algorithm:
+            raise JWTError("The specified alg value is not allowed")
+        if not self._verify(signing_input, signature):
+            raise JWTError("Signature verification failed.")
+        if not isinstance(claims, dict):
+            raise JWTError("Invalid payload")
+        self._validate_claims(claims)
+        return claims
+
+    def _validate_claims(self, claims: dict[str, Any]) -> None:
+        now = time.time()
+        for claim in ("exp", "iat"):
+            if claim not in claims:
+                raise JWTClaimsError(f'missing required key "{claim}" among claims')
+        for claim in ("exp", "iat", "nbf"):
+            if claim in claims and (not isinstance(claims[claim], int) or isinstance(claims[claim], bool)):
+                raise JWTClaimsError(f"{claim} claim must be an integer")
+        if claims["exp"] < now - self.leeway:
+            raise ExpiredSignatureError("Signature has expired.")
+        if "nbf" in claims and claims["nbf"] > now + self.leeway:
+            raise JWTClaimsError("The token is not yet valid (nbf)")
+        if "aud" in claims:
+            # No audience is expected, like `jose` without an `audience`
+            raise JWTClaimsError("Invalid audience")
+
+
+class HMACTokenCodec(_CompactTokenCodec):
+    """
+    Codec for the HS256/HS384/HS512 algorithms on top of the standard library. The keyed HMAC state is copied for
+    every token instead of being derived from the secret.
+    """
+
+    _DIGESTS = {"HS256": hashlib.sha256, "HS384": hashlib.sha384, "HS512": hashlib.sha512}
+
+    def __init__(self, algorithm: str, secret: str, leeway: int = 0, kid: str | None = None) -> None:
+        if algorithm not in self._DIGESTS:
+            raise ValueError(f"Algorithm {algorithm} is not supported by the hmac token codec")
+        super().__init__(algorithm, leeway, kid)
+        self._mac = hmac.new(secret.encode(), digestmod=self._DIGESTS[algorithm])
+
+    def _sign(self, signing_input: bytes) -> bytes:
+        mac = self._mac.copy()
+        mac.update(signing_input)
+        return mac.digest()
+
+    def _verify(self, signing_input: bytes, signature: bytes) -> bool:
+        return hmac.compare_digest(self._sign(signing_input), signature)
+
+
+class EdDSATokenCodec(_CompactTokenCodec):
+    """
+    Codec for EdDSA with Ed25519 or Ed448 keys, which `python-jose` does not implement.
+    Requires the `eddsa` extra: `uv sync --extra eddsa`.
+    """
+
+    def __init__(
+        self,
+        signing_key: str | None,
+        verification_key: str | None = None,
+        leeway: int = 0,
+        kid: str | None = None,
+    ) -> None:
+        try:
+            from cryptography.exceptions import InvalidSignature  # noqa: PLC0415
+            from cryptography.hazmat.primitives.asymmetric import ed448, ed25519  # noqa: PLC0415
+            from cryptography.hazmat.primitives.serialization import (  # noqa: PLC0415
+                Encoding,
+                PublicFormat,
+                load_pem_private_key,
+                load_pem_public_key,
+            )
+        except ImportError as e:
+            raise RuntimeError("EdDSA requires `cryptography`, install it with `uv sync --extra eddsa`") from e
+
+        super().__init__("EdDSA", leeway, kid)
+        self._invalid_signature = InvalidSignature
+        self._private_key = load_pem_private_key(signing_key.encode(), password=None) if signing_key else None
+        if verification_key is not None:
+            self._public_key = load_pem_public_key(verification_key.encode())
+        elif self._private_key is not None:
+            self._public_key = self._private_key.public_key()
+        else:
+            raise ValueError("A signing or verification key is required")
+
+        curves = {ed25519.Ed25519PublicKey: "Ed25519", ed448.Ed448PublicKey: "Ed448"}
+        curve = next((name for cls, name in curves.items() if isinstance(self._public_key, cls)), None)
+        if curve is None:
+            raise ValueError("EdDSA keys must be Ed25519 or Ed448 keys")
+        self._jwk = {
+            "kty": "OKP",
+            "crv": curve,
+            "x": _b64encode(self._public_key.public_bytes(Encoding.Raw, PublicFormat.Raw)).decode(),
+            "alg": "EdDSA",
+        }
+
+    def _sign(self, signing_input: bytes) -> bytes:
+        if self._private_key is None:
+            raise RuntimeError(f"Key {self.kid} has no private key to sign with")
+        return self._private_key.sign(signing_input)
+
+    def _verify(self, signing_input: bytes, signature: bytes) -> bool:
+        try:
+            self._public_key.verify(signature, signing_input)
+        except self._invalid_signature:
+            return False
+        return True
+
+    def jwks(self) -> list[dict[str, Any]]:
+        return [{**self._jwk, "kid": self.kid, "use": "sig"}]
+
+
+class KeyRingTokenCodec(TokenCodec):
+    """
+    Signs with one key and verifies with any key of the ring, picked by the `kid` header. Keys are rotated by
+    adding the new one, switching signing to it once verifiers know it, and removing the old one after the last
+    token it signed expired.
+    """
+
+    def __init__(self, codecs: Sequence[TokenCodec], signing_kid: str) -> None:
+        self._codecs = {codec.kid: codec for codec in codecs}
+        if signing_kid not in self._codecs:
+            raise ValueError(f"Unknown signing key {signing_kid}")
+        self._signing_codec = self._codecs[signing_kid]
+        self.algorithm = self._signing_codec.algorithm
+        self.kid = signing_kid
+
+    def encode(self, claims: dict[str, Any]) -> str:
+        return self._signing_codec.encode(claims)
+
+    def decode(self, token: str) -> dict[str, Any]:
+        codec = self._codecs.get(jwt.get_unverified_header(token).get("kid"))
+        if codec is None:
+            raise JWTError("Unknown signing key")
+        return codec.decode(token)
+
+    def jwks(self) -> list[dict[str, Any]]:
+        return [jwk for codec in self._codecs.values() for jwk in codec.jwks()]
+
+
+def create_token_codec(
+    backend: Literal["jose", "hmac"],
+    algorithm: str,
+    signing_key: str | None,
+    verification_key: str | None = None,
+    leeway: int = 0,
+    kid: str | None = None,
+) -> TokenCodec:
+    """
+    EdDSA always uses `cryptography`, the backend picks the implementation of the other algorithms.
+    """
+    if algorithm == "EdDSA":
+        return EdDSATokenCodec(signing_key, verification_key, leeway=leeway, kid=kid)
+    if backend == "hmac":
+        if signing_key is None:
+            raise ValueError("HMAC keys are secret, the signing key is required")
+        return HMACTokenCodec(algorithm, signing_key, leeway=leeway, kid=kid)
+    return JoseTokenCodec(algorithm, signing_key, verification_key, leeway=leeway, kid=kid)
+
+
+def _create_configured_codec() -> TokenCodec:
+    if not auth_settings.signing_keys:
+        return create_token_codec(
+            auth_settings.token_codec,
+            auth_settings.encryption_algorithm,
+            api_settings.secret_key.get_secret_value(),
+            leeway=auth_settings.leeway,
+        )
+    codecs = [
+        create_token_codec(
+            auth_settings.token_codec,
+            key.algorithm or auth_settings.encryption_algorithm,
+            key.private_key.get_secret_value() if key.private_key is not None else None,
+            key.public_key,
+            leeway=auth_settings.leeway,
+            kid=key.kid,
+        )
+        for key in auth_settings.signing_keys
+    ]
+    return KeyRingTokenCodec(codecs, auth_settings.signing_key_id or auth_settings.signing_keys[0].kid)
+
+
+token_codec = _create_configured_codec()
+
 ACCESS_TTL = timedelta(minutes=auth_settings.access_token_ttl_minutes)
 REFRESH_TTL = timedelta(days=auth_settings.refresh_token_ttl_days)
 
+_verified_tokens = TTLCache[bytes, TokenPayload](
+    "access_token", maxsize=auth_settings.token_cache_size, ttl=ACCESS_TTL.total_seconds()
+)
+"Payloads of verified access tokens by token digest, each expiring with its token"
+
 
 def _now_utc_ts() -> int:
     return int(datetime.now(UTC).timestamp())
@@ -20,11 +333,7 @@ def _exp_ts(ttl: timedelta) -> int:
 
 
 def _encode_jwt(claims: dict) -> str:
-    return jwt.encode(
-        claims,
-        api_settings.secret_key.get_secret_value(),
-        algorithm=auth_settings.encryption_algorithm,
-    )
+    return token_codec.encode(claims)
 
 
 def create_access_token(
@@ -32,6 +341,7 @@ def create_access_token(
     scope: str | None = None,
     extra_claims: dict | None = None,
     expires_delta: timedelta | None = None,
+    token_version: int = 0,
 ) -> str:
     iat = _now_utc_ts()
     exp = _exp_ts(expires_delta or ACCESS_TTL)
@@ -40,6 +350,7 @@ def create_access_token(
         "type": "access",
         "iat": iat,
         "exp": exp,
+        "token_version": token_version,
     }
     if scope:
         claims["scope"] = scope  # space-delimited
@@ -50,7 +361,10 @@ def create_access_token(
 
 def create_refresh_token(
     subject: str,
+    jti: str,
+    family_id: str,
     extra_claims: dict | None = None,
+    token_version: int = 0,
 ) -> str:
     iat = _now_utc_ts()
     exp = _exp_ts(REFRESH_TTL)
@@ -59,6 +373,9 @@ def create_refresh_token(
         "type": "refresh",
         "iat": iat,
         "exp": exp,
+        "token_version": token_version,
+        "jti": jti,
+        "fam": family_id,
     }
     if extra_claims:
         claims.update(extra_claims)
@@ -66,13 +383,25 @@ def create_refresh_token(
 
 
 def decode_token(token: str, expected_type: TokenType = "access") -> TokenPayload:
+    # Clients send the same access token over and over, only verify it once. Refresh tokens are used once each
+    use_cache = expected_type == "access" and _verified_tokens.enabled
+    if use_cache:
+        digest = hashlib.blake2b(token.encode(), digest_size=16).digest()
+        cached = _verified_tokens.get(digest)
+        if cached is not None:
+            _verified_tokens.hits.inc()
+            return cached
+        _verified_tokens.misses.inc()
+
+    token_payload = _verify_token(token, expected_type)
+    if use_cache:
+        _verified_tokens.set(digest, token_payload, ttl=token_payload.exp - time.time())
+    return token_payload
+
+
+def _verify_token(token: str, expected_type: TokenType) -> TokenPayload:
     try:
-        payload = jwt.decode(
-            token,
-            api_settings.secret_key.get_secret_value(),
-            algorithms=[auth_settings.encryption_algorithm],
-            options={"require_exp": True, "require_iat": True, "leeway": auth_settings.leeway},
-        )
+        payload = token_codec.decode(token)
         if payload.get("type") != expected_type:
             raise JWTClaimsError(f"Invalid token type. Expected {expected_type}.")
         return TokenPayload(**payload)
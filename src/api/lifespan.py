@@ -1,20 +1,82 @@
-from contextlib import asynccontextmanager
+import asyncio
+from contextlib import asynccontextmanager, suppress
 
 from fastapi import FastAPI
 
-import src.api.logging_  # noqa: F401
-from src.config import api_settings
-from src.db import SQLAlchemyStorage
+from src.api.auth.passwords import password_hasher
+from src.api.auth.revocation import cleanup_refresh_tokens, revoked_families
+from src.api.logging_ import logger
+from src.api.rate_limit import DatabaseRateLimitStore, MemoryRateLimitStore, RateLimiter, prune_rate_limit_buckets
+from src.config import api_settings, auth_settings
+from src.db import AbstractSQLAlchemyStorage, SQLAlchemyStorage, SQLiteStorage, singleflight
+from src.db.invalidation import InvalidationListener
+from src.db.repositories import RefreshTokenRepository, UserRepository
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Application startup
-    storage = SQLAlchemyStorage.from_url(api_settings.db_url.get_secret_value())
+    singleflight.configure(api_settings.single_flight, api_settings.single_flight_overrides)
+    if auth_settings.password_hash_rounds is None:
+        rounds = await password_hasher.calibrate(
+            auth_settings.password_hash_target_seconds, auth_settings.password_hash_min_rounds
+        )
+        logger.info(f"Calibrated bcrypt cost to {rounds} rounds")
+    db_url = api_settings.db_url.get_secret_value()
+    storage: AbstractSQLAlchemyStorage
+    invalidation_listener: InvalidationListener | None = None
+    if db_url.startswith("sqlite"):
+        # Benchmarks and tests without Postgres: no migrations, tables are created from the models
+        storage = SQLiteStorage.from_url(db_url)
+        await storage.create_all()
+    else:
+        storage = SQLAlchemyStorage.from_url(
+            db_url,
+            replica_urls=[url.get_secret_value() for url in api_settings.db_replica_urls],
+            balancing=api_settings.db_replica_balancing,
+            replica_retry_after=api_settings.db_replica_health_check_interval,
+            **api_settings.pool.engine_kwargs(),
+        )
+        storage.start_replica_health_checks(api_settings.db_replica_health_check_interval)
+        # Other workers cache users too, evict what they change
+        invalidation_listener = InvalidationListener(db_url, api_settings.cache_invalidation_check_interval)
+        invalidation_listener.start()
     app.state.storage = storage
+    # Shared by all requests, each batch uses a short-lived session of its own
+    app.state.user_loader = UserRepository(storage).create_user_loader(
+        window=api_settings.batch_loader_window, max_batch_size=api_settings.batch_loader_max_size
+    )
+    for family_id in await RefreshTokenRepository(storage).list_revoked_families():
+        revoked_families.add(family_id)
+    refresh_token_cleanup = asyncio.create_task(
+        cleanup_refresh_tokens(
+            storage,
+            auth_settings.refresh_token_cleanup_interval_seconds,
+            auth_settings.refresh_token_cleanup_batch_size,
+        )
+    )
+    background_tasks = [refresh_token_cleanup]
+    rate_limit = api_settings.rate_limit
+    if rate_limit.enabled:
+        rate_limit_store = (
+            DatabaseRateLimitStore(storage)
+            if rate_limit.store == "database"
+            else MemoryRateLimitStore(rate_limit.max_memory_buckets)
+        )
+        app.state.rate_limiter = RateLimiter(rate_limit_store, rate_limit)
+        background_tasks.append(
+            asyncio.create_task(prune_rate_limit_buckets(app.state.rate_limiter, rate_limit.prune_interval_seconds))
+        )
 
     try:
         yield
     finally:
         # Application shutdown
+        for task in background_tasks:
+            task.cancel()
+            with suppress(asyncio.CancelledError):
+                await task
+        if invalidation_listener is not None:
+            await invalidation_listener.stop()
         await storage.close_connection()
+        password_hasher.shutdown()
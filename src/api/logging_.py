@@ -1,9 +1,13 @@
 __all__ = ["logger"]
 
-import asyncio
+import functools
 import inspect
 import logging.config
 import os
+import random
+import time
+from collections.abc import Callable
+from dataclasses import dataclass
 from typing import Any
 
 import fastapi
@@ -11,10 +15,18 @@ import yaml
 from fastapi.dependencies.models import Dependant
 from starlette.concurrency import run_in_threadpool
 
+from src.config import api_settings
+
+
+@functools.cache
+def _relative_path(pathname: str) -> str:
+    return os.path.relpath(pathname)
+
 
 class RelativePathFilter(logging.Filter):
     def filter(self, record: logging.LogRecord) -> bool:
-        record.relativePath = os.path.relpath(record.pathname)
+        if not hasattr(record, "relativePath"):
+            record.relativePath = _relative_path(record.pathname)
         return True
 
 
@@ -42,37 +54,68 @@ else:
 logger = logging.getLogger("src")
 logger.addFilter(RelativePathFilter())
 
+endpoint_timing = api_settings.endpoint_timing
+
+
+@dataclass(frozen=True, slots=True)
+class EndpointMetadata:
+    name: str
+    pathname: str
+    relative_path: str
+    lineno: int
+
+
+_endpoint_metadata: dict[Callable[..., Any], EndpointMetadata] = {}
+"Source location of each endpoint, looked up on its first call instead of on every request"
+
+
+def _get_endpoint_metadata(callback: Callable[..., Any]) -> EndpointMetadata:
+    metadata = _endpoint_metadata.get(callback)
+    if metadata is None:
+        pathname = inspect.getsourcefile(callback) or "unknown"
+        code = getattr(inspect.unwrap(callback), "__code__", None)
+        metadata = _endpoint_metadata[callback] = EndpointMetadata(
+            name=callback.__name__,
+            pathname=pathname,
+            relative_path=_relative_path(pathname),
+            # Line of the first decorator, like `inspect.getsourcelines` without reading the file
+            lineno=code.co_firstlineno if code is not None else 0,
+        )
+    return metadata
+
 
 async def run_endpoint_function(*, dependant: Dependant, values: dict[str, Any], is_coroutine: bool) -> Any:
     # Only called by get_request_handler. Has been split into its own function to
     # facilitate profiling endpoints, since inner functions are harder to profile.
     assert dependant.call is not None, "dependant.call must be a function"
-    loop = asyncio.get_running_loop()
-    start_time = loop.time()
+    sampled = endpoint_timing.sample_rate >= 1 or random.random() < endpoint_timing.sample_rate
+    start_time = time.perf_counter() if sampled else 0.0
     if is_coroutine:
         r = await dependant.call(**values)
     else:
         r = await run_in_threadpool(dependant.call, **values)
-    finish_time = loop.time()
-    duration = finish_time - start_time
-    callback = dependant.call
-    func_name = callback.__name__
-    pathname = inspect.getsourcefile(callback) or "unknown"
-    lineno = inspect.getsourcelines(callback)[1]
+    if not sampled:
+        return r
+    duration = time.perf_counter() - start_time
+    if duration * 1000 < endpoint_timing.threshold_ms or not logger.isEnabledFor(logging.INFO):
+        return r
+
+    metadata = _get_endpoint_metadata(dependant.call)
     record = logging.LogRecord(
         name="src.fastapi.run_endpoint_function",
         level=logging.INFO,
-        pathname=pathname,
-        lineno=lineno,
-        msg=f"Handler `{func_name}` took {int(duration * 1000)} ms",
+        pathname=metadata.pathname,
+        lineno=metadata.lineno,
+        msg=f"Handler `{metadata.name}` took {int(duration * 1000)} ms",
         args=(),
         exc_info=None,
-        func=func_name,
+        func=metadata.name,
     )
-    record.relativePath = os.path.relpath(record.pathname)
+    record.relativePath = metadata.relative_path
     logger.handle(record)
     return r
 
 
-# monkey patch fastapi to log endpoint function duration and link to source code
-fastapi.routing.run_endpoint_function = run_endpoint_function
+if endpoint_timing.enabled:
+    # monkey patch fastapi to log endpoint function duration and link to source code
+    fastapi.routing.run_endpoint_function = run_endpoint_function
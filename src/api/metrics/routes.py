@@ -0,0 +1,14 @@
+from typing import Any
+
+from fastapi import APIRouter, Depends
+from fastapi_derive_responses import AutoDeriveResponsesAPIRoute
+
+from src import metrics
+from src.api.auth.dependencies import Principal, require_admin_principal
+
+router = APIRouter(prefix="/metrics", tags=["Metrics"], route_class=AutoDeriveResponsesAPIRoute)
+
+
+@router.get("")
+async def get_metrics(_: Principal = Depends(require_admin_principal)) -> dict[str, Any]:
+    return metrics.snapshot()
@@ -0,0 +1,354 @@
+__all__ = [
+    "DatabaseRateLimitStore",
+    "MemoryRateLimitStore",
+    "RateLimitDecision",
+    "RateLimitMiddleware",
+    "RateLimitStore",
+    "RateLimiter",
+    "prune_rate_limit_buckets",
+]
+
+import asyncio
+import json
+import math
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from collections.abc import Mapping
+from dataclasses import dataclass
+from typing import Literal
+
+from fastapi import HTTPException, status
+from starlette.routing import Match, Route
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from src import metrics
+from src.api.auth.util import decode_token
+from src.api.logging_ import logger
+from src.config_schema import RateLimitBucketSettings, RateLimitSettings
+from src.db import AbstractSQLAlchemyStorage
+from src.db.repositories import RateLimitRepository
+
+BucketKind = Literal["username", "subject", "ip"]
+
+_MAX_USERNAME_LENGTH = 256
+"Longer usernames are cut, so that attempts cannot make the bucket keys arbitrarily large"
+
+_MAX_CREDENTIALS_BODY = 8192
+"Bodies of credential requests read for the username, larger ones are only limited by address"
+
+
+@dataclass(frozen=True, slots=True)
+class RateLimitDecision:
+    allowed: bool
+    limit: float
+    "Capacity of the bucket"
+    remaining: float
+    "Tokens left in the bucket"
+    reset_after: float
+    "Seconds until the bucket is full again"
+    retry_after: float
+    "Seconds until the rejected request would be allowed, 0 if it was allowed"
+
+
+class RateLimitStore(ABC):
+    @abstractmethod
+    async def take(self, key: str, cost: float, bucket: RateLimitBucketSettings) -> float | None:
+        """
+        Take `cost` tokens from the bucket of `key`. Returns the tokens left, None if there were not enough,
+        in which case none were taken.
+        """
+
+    @abstractmethod
+    async def prune(self, idle_seconds: float) -> int:
+        """
+        Forget the buckets without requests for `idle_seconds`. Returns the number of forgotten buckets.
+        """
+
+
+class MemoryRateLimitStore(RateLimitStore):
+    """
+    Buckets of this process, at most `max_buckets` of them, the least recently used ones are dropped first.
+    """
+
+    max_buckets: int
+
+    def __init__(self, max_buckets: int = 100_000) -> None:
+        self.max_buckets = max_buckets
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+        "Tokens and monotonic time of the last request by key"
+        metrics.gauge("rate_limit.buckets", lambda: len(self._buckets), "Number of buckets kept in memory")
+
+    async def take(self, key: str, cost: float, bucket: RateLimitBucketSettings) -> float | None:
+        now = time.monotonic()
+        entry = self._buckets.get(key)
+        if entry is None:
+            tokens = bucket.capacity
+        else:
+            tokens, updated_at = entry
+            tokens = min(bucket.capacity, tokens + (now - updated_at) * bucket.refill_per_second)
+        if tokens < cost:
+            return None
+        self._buckets[key] = (tokens - cost, now)
+        self._buckets.move_to_end(key)
+        while len(self._buckets) > self.max_buckets:
+            self._buckets.popitem(last=False)
+        return tokens - cost
+
+    async def prune(self, idle_seconds: float) -> int:
+        before = time.monotonic() - idle_seconds
+        idle = [key for key, (_, updated_at) in self._buckets.items() if updated_at < before]
+        for key in idle:
+            del self._buckets[key]
+        return len(idle)
+
+
+class DatabaseRateLimitStore(RateLimitStore):
+    """
+    Buckets in the database, shared by all workers. Every bucket check is a round trip of its own.
+    """
+
+    def __init__(self, storage: AbstractSQLAlchemyStorage, batch_size: int = 1000) -> None:
+        self._repository = RateLimitRepository(storage)
+        self.batch_size = batch_size
+
+    async def take(self, key: str, cost: float, bucket: RateLimitBucketSettings) -> float | None:
+        # Wall clock time, as it is compared across processes and hosts
+        return await self._repository.take_tokens(key, cost, bucket.capacity, bucket.refill_per_second, time.time())
+
+    async def prune(self, idle_seconds: float) -> int:
+        before = time.time() - idle_seconds
+        deleted = 0
+        while (batch := await self._repository.delete_idle_buckets(before, self.batch_size)) > 0:
+            deleted += batch
+            if batch < self.batch_size:
+                break
+        return deleted
+
+
+class RateLimiter:
+    """
+    Token bucket limits per attempted username, authenticated user and client address. A request takes its route
+    cost from each bucket that applies to it and is rejected as soon as one is empty; the buckets checked before
+    it keep the tokens taken.
+    """
+
+    store: RateLimitStore
+    buckets: dict[BucketKind, RateLimitBucketSettings]
+    route_costs: dict[str, float]
+    credential_routes: frozenset[str]
+
+    def __init__(self, store: RateLimitStore, settings: RateLimitSettings) -> None:
+        self.store = store
+        # Most specific first, so that a password guessing burst is cut off before it drains the address bucket
+        self.buckets = {
+            kind: bucket
+            for kind, bucket in (("username", settings.username), ("subject", settings.subject), ("ip", settings.ip))
+            if bucket is not None
+        }
+        self.route_costs = dict(settings.route_costs)
+        self.credential_routes = frozenset(settings.credential_routes)
+        self.rejected = {
+            kind: metrics.counter(f"rate_limit.{kind}.rejected", f"Requests rejected by a {kind} bucket")
+            for kind in self.buckets
+        }
+        self._routes: list[Route] | None = None
+        "Routes with a configured cost or credentials, the only ones requests are matched against"
+
+    @property
+    def idle_seconds(self) -> float:
+        "Time after which any bucket is full again"
+        return max((bucket.capacity / bucket.refill_per_second for bucket in self.buckets.values()), default=0)
+
+    async def check(self, keys: Mapping[BucketKind, str], cost: float) -> RateLimitDecision | None:
+        """
+        Take `cost` tokens from the bucket of each key. Returns the decision of the rejecting bucket, or of the one
+        with the fewest tokens left, None if no bucket applies.
+        """
+        decision: RateLimitDecision | None = None
+        for kind, bucket in self.buckets.items():
+            key = keys.get(kind)
+            if key is None:
+                continue
+            remaining = await self.store.take(f"{kind}:{key}", cost, bucket)
+            if remaining is None:
+                self.rejected[kind].inc()
+                # Without the exact tokens left, assume the bucket is empty
+                return RateLimitDecision(
+                    allowed=False,
+                    limit=bucket.capacity,
+                    remaining=0,
+                    reset_after=bucket.capacity / bucket.refill_per_second,
+                    retry_after=min(cost, bucket.capacity) / bucket.refill_per_second,
+                )
+            if decision is None or remaining < decision.remaining:
+                decision = RateLimitDecision(
+                    allowed=True,
+                    limit=bucket.capacity,
+                    remaining=remaining,
+                    reset_after=(bucket.capacity - remaining) / bucket.refill_per_second,
+                    retry_after=0,
+                )
+        return decision
+
+    def route_template(self, scope: Scope) -> str | None:
+        """
+        `METHOD /path/{param}` of the route matching the request, None if it is not one with a configured cost or
+        credentials. Only those routes are tried, the others would all be treated alike anyway.
+        """
+        if self._routes is None:
+            templates = self.route_costs.keys() | self.credential_routes
+            self._routes = [
+                route
+                for route in scope["app"].router.routes
+                if isinstance(route, Route)
+                and any(f"{method} {route.path}" in templates for method in route.methods or ())
+            ]
+        for route in self._routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return f"{scope['method']} {route.path}"
+        return None
+
+
+def _bearer_subject(scope: Scope) -> str | None:
+    for name, value in scope["headers"]:
+        if name == b"authorization":
+            scheme, _, token = value.decode("latin-1").partition(" ")
+            if scheme.lower() != "bearer" or not token:
+                return None
+            try:
+                return decode_token(token).sub
+            except HTTPException:
+                # Invalid tokens are rejected by the endpoint, the request is only limited by address
+                return None
+    return None
+
+
+async def _read_body(receive: Receive) -> tuple[bytes | None, list[Message]]:
+    """
+    Read the request body, giving up once it exceeds `_MAX_CREDENTIALS_BODY`. Returns the body, None if it was
+    given up on, and the messages read so far, which the app still has to receive.
+    """
+    messages = []
+    body = b""
+    while True:
+        message = await receive()
+        messages.append(message)
+        if message["type"] != "http.request":
+            return body, messages
+        body += message.get("body", b"")
+        if len(body) > _MAX_CREDENTIALS_BODY:
+            return None, messages
+        if not message.get("more_body", False):
+            return body, messages
+
+
+def _username(body: bytes) -> str | None:
+    try:
+        username = json.loads(body).get("username")
+    except (ValueError, AttributeError):
+        return None
+    return username[:_MAX_USERNAME_LENGTH] if isinstance(username, str) else None
+
+
+class RateLimitMiddleware:
+    """
+    Throttle requests with the `RateLimiter` in `app.state.rate_limiter`, if any. Rejected requests get a 429
+    response with `Retry-After`, all limited responses the `RateLimit-Limit`, `RateLimit-Remaining` and
+    `RateLimit-Reset` headers of the bucket closest to running out.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        limiter: RateLimiter | None = (
+            getattr(scope["app"].state, "rate_limiter", None) if scope["type"] == "http" else None
+        )
+        if limiter is None:
+            await self.app(scope, receive, send)
+            return
+
+        route = limiter.route_template(scope)
+        keys: dict[BucketKind, str] = {}
+        if scope.get("client"):
+            keys["ip"] = scope["client"][0]
+        subject = _bearer_subject(scope)
+        if subject is not None:
+            keys["subject"] = subject
+        if route in limiter.credential_routes and "username" in limiter.buckets:
+            body, messages = await _read_body(receive)
+            username = _username(body) if body is not None else None
+            if username is not None:
+                keys["username"] = username
+            receive = self._replay(messages, receive)
+
+        try:
+            decision = await limiter.check(keys, limiter.route_costs.get(route, 1) if route is not None else 1)
+        except Exception:
+            # Fail open, an unavailable store must not take the whole API down
+            logger.exception("Rate limit check failed")
+            decision = None
+        if decision is None:
+            await self.app(scope, receive, send)
+            return
+
+        headers = [
+            (b"ratelimit-limit", str(math.floor(decision.limit)).encode()),
+            (b"ratelimit-remaining", str(math.floor(decision.remaining)).encode()),
+            (b"ratelimit-reset", str(math.ceil(decision.reset_after)).encode()),
+        ]
+        if not decision.allowed:
+            await self._reject(send, decision, headers)
+            return
+
+        async def send_with_headers(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                message = {**message, "headers": [*message.get("headers", []), *headers]}
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
+
+    @staticmethod
+    def _replay(messages: list[Message], receive: Receive) -> Receive:
+        """
+        Hand the messages read for the username to the app before receiving further ones.
+        """
+        pending = list(messages)
+
+        async def replay() -> Message:
+            if pending:
+                return pending.pop(0)
+            return await receive()
+
+        return replay
+
+    @staticmethod
+    async def _reject(send: Send, decision: RateLimitDecision, headers: list[tuple[bytes, bytes]]) -> None:
+        body = json.dumps({"detail": "Too many requests"}).encode()
+        await send(
+            {
+                "type": "http.response.start",
+                "status": status.HTTP_429_TOO_MANY_REQUESTS,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                    (b"retry-after", str(max(1, math.ceil(decision.retry_after))).encode()),
+                    *headers,
+                ],
+            }
+        )
+        await send({"type": "http.response.body", "body": body})
+
+
+async def prune_rate_limit_buckets(limiter: RateLimiter, interval: float) -> None:
+    """
+    Every `interval` seconds, forget the buckets that are full again, a new bucket starts full anyway.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await limiter.store.prune(limiter.idle_seconds)
+        except Exception:
+            logger.exception("Failed to prune rate limit buckets")
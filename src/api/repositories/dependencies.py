@@ -1,6 +1,13 @@
+from collections.abc import AsyncIterator
+
 from fastapi import Depends, Request
+from sqlalchemy.ext.asyncio import AsyncSession
 
+from src.config import api_settings
+from src.db.loader import BatchLoader
+from src.db.models import User
 from src.db.repositories import (
+    RefreshTokenRepository,
     UserRepository,
 )
 from src.db.storage import AbstractSQLAlchemyStorage
@@ -13,7 +20,60 @@ def get_storage(request: Request) -> AbstractSQLAlchemyStorage:
     return storage
 
 
+async def get_session(
+    storage: AbstractSQLAlchemyStorage = Depends(get_storage),
+) -> AsyncIterator[AsyncSession]:
+    """
+    Request-scoped session shared by all repositories of a request.
+    The transaction is committed once the handler returns and rolled back if it raises.
+    """
+    async with storage.create_write_session() as session, session.begin():
+        yield session
+
+
+async def get_read_session(
+    storage: AbstractSQLAlchemyStorage = Depends(get_storage),
+    session: AsyncSession = Depends(get_session),
+) -> AsyncIterator[AsyncSession]:
+    """
+    Request-scoped session for read-only queries, bound to a replica if any are configured.
+    Without replicas it is the request session itself, so the request still uses a single connection.
+    """
+    if not storage.has_replicas:
+        yield session
+        return
+
+    async with storage.create_read_session() as read_session:
+        yield read_session
+
+
 def get_user_repository(
     storage: AbstractSQLAlchemyStorage = Depends(get_storage),
+    session: AsyncSession = Depends(get_session),
+    read_session: AsyncSession = Depends(get_read_session),
 ) -> UserRepository:
-    return UserRepository(storage)
+    return UserRepository(storage, session, read_session)
+
+
+def get_refresh_token_repository(
+    storage: AbstractSQLAlchemyStorage = Depends(get_storage),
+    session: AsyncSession = Depends(get_session),
+) -> RefreshTokenRepository:
+    return RefreshTokenRepository(storage, session)
+
+
+def get_user_loader(user_repository: UserRepository = Depends(get_user_repository)) -> BatchLoader[int, User]:
+    """
+    Request-scoped loader batching the user lookups of one request, using its read session.
+    """
+    return user_repository.create_user_loader(max_batch_size=api_settings.batch_loader_max_size)
+
+
+def get_shared_user_loader(request: Request) -> BatchLoader[int, User]:
+    """
+    Process-wide loader batching the user lookups of concurrent requests.
+    """
+    loader = getattr(request.app.state, "user_loader", None)
+    if loader is None:
+        raise RuntimeError("User loader is not initialized. Check lifespan setup.")
+    return loader
@@ -0,0 +1,55 @@
+__all__ = ["NDJSON_MEDIA_TYPE", "stream_json_array", "stream_ndjson", "wants_ndjson"]
+
+from collections.abc import AsyncIterable, AsyncIterator
+from typing import Any
+
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+_FLUSH_EVERY = 200
+"Rows encoded into one chunk of the response body"
+
+
+def wants_ndjson(accept: str | None) -> bool:
+    return accept is not None and NDJSON_MEDIA_TYPE in accept
+
+
+async def _encode(rows: AsyncIterable[Any], schema: type[BaseModel]) -> AsyncIterator[list[bytes]]:
+    batch: list[bytes] = []
+    async for row in rows:
+        batch.append(schema.model_validate(row).model_dump_json().encode())
+        if len(batch) >= _FLUSH_EVERY:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def stream_ndjson(rows: AsyncIterable[Any], schema: type[BaseModel]) -> StreamingResponse:
+    """
+    Stream rows validated with `schema` as newline-delimited JSON, one object per line.
+    """
+
+    async def body() -> AsyncIterator[bytes]:
+        async for batch in _encode(rows, schema):
+            yield b"\n".join(batch) + b"\n"
+
+    return StreamingResponse(body(), media_type=NDJSON_MEDIA_TYPE)
+
+
+def stream_json_array(rows: AsyncIterable[Any], schema: type[BaseModel]) -> StreamingResponse:
+    """
+    Stream rows validated with `schema` as a single JSON array, sent in chunks as the rows are read.
+    """
+
+    async def body() -> AsyncIterator[bytes]:
+        yield b"["
+        separator = b""
+        async for batch in _encode(rows, schema):
+            yield separator + b",".join(batch)
+            separator = b","
+        yield b"]"
+
+    return StreamingResponse(body(), media_type="application/json")
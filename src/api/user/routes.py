@@ -1,64 +1,117 @@
-from fastapi import APIRouter, Depends, HTTPException, Response
+import asyncio
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response
 from fastapi_derive_responses import AutoDeriveResponsesAPIRoute
-from passlib.context import CryptContext
 from starlette import status
 
-from src.api.auth.dependencies import get_current_user, require_admin
+from src.api.auth.dependencies import Principal, get_principal, require_admin_principal
+from src.api.auth.passwords import password_hasher
 from src.api.repositories.dependencies import get_user_repository
-from src.db.models import User
+from src.api.streaming import stream_json_array, stream_ndjson, wants_ndjson
+from src.db.errors import UniqueViolationError
+from src.db.pagination import InvalidCursorError
 from src.db.repositories import UserRepository
-from src.schemas import UserCreate, UserResponse
+from src.db.repositories.user import UserSortKey
+from src.schemas import (
+    BulkConflictResponse,
+    PageResponse,
+    UserBulkCreate,
+    UserBulkResponse,
+    UserCreate,
+    UserResponse,
+)
 
 router = APIRouter(prefix="/users", tags=["Users"], route_class=AutoDeriveResponsesAPIRoute)
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
-
 @router.post("", status_code=status.HTTP_201_CREATED)
 async def create_user(
     payload: UserCreate,
-    _: User = Depends(require_admin),
+    _: Principal = Depends(require_admin_principal),
     user_repository: UserRepository = Depends(get_user_repository),
 ) -> UserResponse:
-    existing_email = await user_repository.get_user_by_email(str(payload.email))
-    if existing_email:
-        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Email already in use")
-
-    existing_username = await user_repository.get_user_by_username(str(payload.username))
-    if existing_username:
-        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Username already in use")
-
-
-    hashed = pwd_context.hash(payload.password)
-    user = await user_repository.create_user(
-        name=payload.name,
-        username=payload.username,
-        email=str(payload.email),
-        hashed_password=hashed,
-        is_admin=payload.is_admin,
-    )
+    hashed = await password_hasher.hash(payload.password)
+    try:
+        user = await user_repository.create_user(
+            name=payload.name,
+            username=payload.username,
+            email=str(payload.email),
+            hashed_password=hashed,
+            is_admin=payload.is_admin,
+        )
+    except UniqueViolationError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"{e.field.capitalize()} already in use")
     return UserResponse.model_validate(user)
 
 
+@router.post("/bulk")
+async def create_users_bulk(
+    payload: UserBulkCreate,
+    _: Principal = Depends(require_admin_principal),
+    user_repository: UserRepository = Depends(get_user_repository),
+) -> UserBulkResponse:
+    hashes = await asyncio.gather(*(password_hasher.hash(user.password, bounded=False) for user in payload.users))
+    rows = [
+        {
+            "name": user.name,
+            "username": user.username,
+            "email": str(user.email),
+            "hashed_password": hashed,
+            "is_admin": user.is_admin,
+        }
+        for user, hashed in zip(payload.users, hashes, strict=True)
+    ]
+    if payload.upsert_on is None:
+        result = await user_repository.create_users_bulk(rows)
+    else:
+        result = await user_repository.upsert_users(rows, conflict_field=payload.upsert_on)
+
+    return UserBulkResponse(
+        created=[UserResponse.model_validate(user) for user in result.created],
+        updated=[UserResponse.model_validate(user) for user in result.updated],
+        conflicts=[BulkConflictResponse.model_validate(conflict) for conflict in result.conflicts],
+    )
+
+
 @router.get("")
 async def list_users(
-    _: User = Depends(require_admin),
+    limit: int = Query(50, ge=1, le=500),
+    cursor: str | None = None,
+    sort: UserSortKey = "id",
+    descending: bool = False,
+    stream: bool = False,
+    accept: str | None = Header(None),
+    _: Principal = Depends(require_admin_principal),
     user_repository: UserRepository = Depends(get_user_repository),
-) -> list[UserResponse]:
-    users = await user_repository.list_users()
-    return [UserResponse.model_validate(user) for user in users]
+) -> PageResponse[UserResponse]:
+    # Export every user without pagination, encoding rows as they are fetched
+    if wants_ndjson(accept):
+        return stream_ndjson(user_repository.stream_users(UserResponse, sort=sort, descending=descending), UserResponse)
+    if stream:
+        return stream_json_array(
+            user_repository.stream_users(UserResponse, sort=sort, descending=descending), UserResponse
+        )
+    try:
+        page = await user_repository.list_users_projected(
+            UserResponse, limit=limit, cursor=cursor, sort=sort, descending=descending
+        )
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    return PageResponse[UserResponse](
+        items=[UserResponse.model_validate(user) for user in page.items],
+        next_cursor=page.next_cursor,
+    )
 
 
 @router.get("/{user_id}")
 async def get_user_endpoint(
     user_id: int,
-    current_user: User = Depends(get_current_user),
+    principal: Principal = Depends(get_principal),
     user_repository: UserRepository = Depends(get_user_repository),
 ) -> UserResponse:
-    user = await user_repository.get_user(user_id)
+    user = await user_repository.get_user_projected(user_id, UserResponse)
     if not user:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"User {user_id} not found")
-    if current_user.id != user_id and not current_user.is_admin:
+    if principal.id != user_id and not principal.is_admin:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Forbidden")
     return UserResponse.model_validate(user)
 
@@ -71,20 +124,12 @@ async def edit_user_endpoint(
     email: str | None = None,
     password: str | None = None,
     is_admin: bool | None = None,
-    current_user: User = Depends(get_current_user),
+    principal: Principal = Depends(get_principal),
     user_repository: UserRepository = Depends(get_user_repository),
 ) -> UserResponse:
-    if current_user.id != user_id and not current_user.is_admin:
+    if principal.id != user_id and not principal.is_admin:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Forbidden")
 
-    existing_email = await user_repository.get_user_by_email(str(email))
-    if existing_email:
-        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Email already in use")
-
-    existing_username = await user_repository.get_user_by_username(str(username))
-    if existing_username:
-        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Username already in use")
-
     update_kwargs: dict = {}
     if name is not None:
         update_kwargs["name"] = name
@@ -93,16 +138,20 @@ async def edit_user_endpoint(
     if email is not None:
         update_kwargs["email"] = email
     if password is not None:
-        update_kwargs["hashed_password"] = pwd_context.hash(password)
+        update_kwargs["hashed_password"] = await password_hasher.hash(password)
+        update_kwargs["revoke_tokens"] = True
     if is_admin is not None:
-        if not current_user.is_admin:
+        if not principal.is_admin:
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only admins can change admin flag")
         update_kwargs["is_admin"] = is_admin
 
     if not update_kwargs:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No changes provided")
 
-    edited = await user_repository.edit_user(user_id, **update_kwargs)
+    try:
+        edited = await user_repository.edit_user(user_id, **update_kwargs)
+    except UniqueViolationError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"{e.field.capitalize()} already in use")
     if edited is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"User {user_id} not found")
     return UserResponse.model_validate(edited)
@@ -111,10 +160,10 @@ async def edit_user_endpoint(
 @router.delete("/{user_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_user_endpoint(
     user_id: int,
-    user: User = Depends(require_admin),
+    principal: Principal = Depends(require_admin_principal),
     user_repository: UserRepository = Depends(get_user_repository),
 ):
-    if user.id == user_id:
+    if principal.id == user_id:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Cannot delete yourself")
     deleted = await user_repository.delete_user(user_id)
     if deleted is None:
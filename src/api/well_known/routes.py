@@ -0,0 +1,32 @@
+import hashlib
+import json
+
+from fastapi import APIRouter, Header, Response, status
+from fastapi_derive_responses import AutoDeriveResponsesAPIRoute
+
+from src.api.auth.util import token_codec
+from src.config import auth_settings
+
+router = APIRouter(prefix="/.well-known", tags=["Discovery"], route_class=AutoDeriveResponsesAPIRoute)
+
+# Keys only change on restart, so the document and its validator are built once
+_jwks = json.dumps({"keys": token_codec.jwks()}, separators=(",", ":")).encode()
+_jwks_headers = {
+    "Cache-Control": f"public, max-age={auth_settings.jwks_max_age_seconds}, stale-if-error=86400",
+    "ETag": f'"{hashlib.blake2b(_jwks, digest_size=16).hexdigest()}"',
+}
+
+
+@router.get(
+    "/jwks.json", response_class=Response, responses={status.HTTP_200_OK: {"content": {"application/json": {}}}}
+)
+async def get_jwks(if_none_match: str | None = Header(None)) -> Response:
+    """
+    Public keys access and refresh tokens are signed with, for other services to verify tokens locally.
+    Empty when tokens are signed with the shared secret.
+    """
+    if if_none_match is not None and (
+        if_none_match.strip() == "*" or _jwks_headers["ETag"] in (tag.strip() for tag in if_none_match.split(","))
+    ):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=_jwks_headers)
+    return Response(_jwks, media_type="application/json", headers=_jwks_headers)
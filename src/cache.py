@@ -0,0 +1,122 @@
+__all__ = ["TTLCache", "clear", "invalidate"]
+
+import asyncio
+import time
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable, Hashable
+
+from src import metrics
+
+_caches: dict[str, list["TTLCache"]] = {}
+
+
+class TTLCache[K: Hashable, V]:
+    """
+    In-process cache with a bounded number of entries evicted least recently used first, each entry expiring
+    `ttl` seconds after it was stored. Concurrent misses of the same key share one load.
+    Caches are registered under a namespace, usually the table of the cached rows, so writers can `invalidate`
+    entries without a reference to the cache.
+    """
+
+    namespace: str
+    maxsize: int
+    ttl: float
+
+    def __init__(self, namespace: str, maxsize: int, ttl: float) -> None:
+        self.namespace = namespace
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: OrderedDict[K, tuple[float, V]] = OrderedDict()
+        self._loading: dict[K, asyncio.Future[V | None]] = {}
+
+        self.hits = metrics.counter(f"cache.{namespace}.hits", "Lookups answered from the cache")
+        self.misses = metrics.counter(f"cache.{namespace}.misses", "Lookups that had to load the value")
+        self.coalesced = metrics.counter(f"cache.{namespace}.coalesced", "Misses that joined an in-flight load")
+        metrics.gauge(f"cache.{namespace}.size", lambda: len(self._entries), "Number of cached entries")
+        _caches.setdefault(namespace, []).append(self)
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0 and self.maxsize > 0
+
+    def get(self, key: K) -> V | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: K, value: V, ttl: float | None = None) -> None:
+        """
+        Store the value for `ttl` seconds, or the cache TTL if it is shorter or not given.
+        """
+        if not self.enabled:
+            return
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0:
+            return
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    async def get_or_load(self, key: K, load: Callable[[], Awaitable[V | None]]) -> V | None:
+        """
+        Return the cached value or load it. None results are returned but not cached.
+        """
+        value = self.get(key)
+        if value is not None:
+            self.hits.inc()
+            return value
+        self.misses.inc()
+
+        future = self._loading.get(key)
+        if future is None:
+            future = asyncio.ensure_future(load())
+            self._loading[key] = future
+            future.add_done_callback(lambda done: self._on_loaded(key, done))
+        else:
+            self.coalesced.inc()
+        # Shielded so that a cancelled caller does not cancel the load shared with the others
+        return await asyncio.shield(future)
+
+    def _on_loaded(self, key: K, future: asyncio.Future[V | None]) -> None:
+        if self._loading.get(key) is not future:
+            # Invalidated while loading, the result may already be stale
+            return
+        del self._loading[key]
+        if future.cancelled() or future.exception() is not None:
+            return
+        value = future.result()
+        if value is not None:
+            self.set(key, value)
+
+    def invalidate(self, key: K) -> None:
+        self._entries.pop(key, None)
+        self._loading.pop(key, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._loading.clear()
+
+
+def invalidate(namespace: str, key: Hashable) -> None:
+    """
+    Drop `key` from every cache registered under `namespace`.
+    """
+    for cache in _caches.get(namespace, ()):
+        cache.invalidate(key)
+
+
+def clear(namespace: str | None = None) -> None:
+    """
+    Drop all entries of the caches registered under `namespace`, or of all caches.
+    """
+    for name, caches in _caches.items():
+        if namespace is None or name == namespace:
+            for cache in caches:
+                cache.clear()
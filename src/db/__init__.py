@@ -1,3 +1,3 @@
-__all__ = ["AbstractSQLAlchemyStorage", "SQLAlchemyStorage"]
+__all__ = ["AbstractSQLAlchemyStorage", "SQLAlchemyStorage", "SQLiteStorage"]
 
-from src.db.storage import AbstractSQLAlchemyStorage, SQLAlchemyStorage
+from src.db.storage import AbstractSQLAlchemyStorage, SQLAlchemyStorage, SQLiteStorage
@@ -0,0 +1,179 @@
+__all__ = ["DEFAULT_CHUNK_SIZE", "BulkConflict", "BulkResult", "bulk_insert", "bulk_upsert", "dialect_insert"]
+
+from collections.abc import Callable, Iterator, Mapping, Sequence
+from dataclasses import dataclass, field
+from typing import Any
+
+from sqlalchemy import ColumnCollection, Insert, or_, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.db.models import Base
+
+DEFAULT_CHUNK_SIZE = 1000
+"Rows per INSERT statement, keeps the number of bind parameters well below the Postgres limit of 32767"
+
+
+@dataclass
+class BulkConflict:
+    index: int
+    "Position of the row in the input"
+    field: str | None
+    "Unique field the row conflicts on, None if it failed for another reason"
+
+
+@dataclass
+class BulkResult[T]:
+    created: list[T] = field(default_factory=list)
+    updated: list[T] = field(default_factory=list)
+    conflicts: list[BulkConflict] = field(default_factory=list)
+
+
+def _chunked(rows: Sequence[Mapping[str, Any]], size: int) -> Iterator[list[tuple[int, Mapping[str, Any]]]]:
+    for start in range(0, len(rows), size):
+        yield list(enumerate(rows[start : start + size], start=start))
+
+
+def dialect_insert(session: AsyncSession, model: type[Base]) -> Insert:
+    """
+    INSERT of the session dialect, which supports `on_conflict_do_nothing` and `on_conflict_do_update`.
+    """
+    if session.bind.dialect.name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert  # noqa: PLC0415
+    else:
+        from sqlalchemy.dialects.postgresql import insert  # noqa: PLC0415
+    return insert(model)
+
+
+async def _find_conflicts(
+    session: AsyncSession,
+    model: type[Base],
+    rows: Sequence[tuple[int, Mapping[str, Any]]],
+    unique_fields: Sequence[str],
+) -> list[BulkConflict]:
+    """
+    Resolve which unique field each rejected row collides with, using one query for all of them.
+    """
+    if not rows:
+        return []
+    if not unique_fields:
+        return [BulkConflict(index=index, field=None) for index, _ in rows]
+
+    columns = [getattr(model, name) for name in unique_fields]
+    result = await session.execute(
+        select(*columns).where(or_(*(column.in_([row[column.key] for _, row in rows]) for column in columns)))
+    )
+    taken: dict[str, set[Any]] = {name: set() for name in unique_fields}
+    for existing in result:
+        for name in unique_fields:
+            taken[name].add(getattr(existing, name))
+
+    return [
+        BulkConflict(index=index, field=next((name for name in unique_fields if row[name] in taken[name]), None))
+        for index, row in rows
+    ]
+
+
+async def bulk_insert[T: Base](
+    session: AsyncSession,
+    model: type[T],
+    rows: Sequence[Mapping[str, Any]],
+    unique_fields: Sequence[str] = (),
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> BulkResult[T]:
+    """
+    Insert rows with one multi-row `INSERT ... ON CONFLICT DO NOTHING ... RETURNING` per chunk.
+    Rows colliding with existing ones (or with each other) on any unique field are reported as conflicts.
+    """
+    result = BulkResult[T]()
+    for chunk in _chunked(rows, chunk_size):
+        stmt = dialect_insert(session, model).values([row for _, row in chunk]).on_conflict_do_nothing()
+        inserted = list((await session.scalars(stmt.returning(model))).all())
+
+        if not unique_fields:
+            result.created.extend(inserted)
+            continue
+
+        # Match returned rows back to the input by their unique values, each returned row is consumed once
+        by_key: dict[tuple, list[T]] = {}
+        for obj in inserted:
+            by_key.setdefault(tuple(getattr(obj, name) for name in unique_fields), []).append(obj)
+        rejected = []
+        for index, row in chunk:
+            matches = by_key.get(tuple(row[name] for name in unique_fields))
+            if matches:
+                result.created.append(matches.pop())
+            else:
+                rejected.append((index, row))
+        result.conflicts.extend(await _find_conflicts(session, model, rejected, unique_fields))
+    return result
+
+
+async def bulk_upsert[T: Base](
+    session: AsyncSession,
+    model: type[T],
+    rows: Sequence[Mapping[str, Any]],
+    conflict_field: str,
+    unique_fields: Sequence[str] = (),
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    on_update: Callable[[ColumnCollection], Mapping[str, Any]] | None = None,
+) -> BulkResult[T]:
+    """
+    Insert rows or update the existing ones matching on `conflict_field`, with one multi-row
+    `INSERT ... ON CONFLICT (conflict_field) DO UPDATE ... RETURNING` per chunk.
+    Repeated `conflict_field` values keep the last row, rows colliding on other unique fields are reported
+    as conflicts and do not affect the rest of their chunk.
+    `on_update` builds further values of the updated rows from the `excluded` row, e.g. to bump a version.
+    """
+    conflict_column = getattr(model, conflict_field)
+    result = BulkResult[T]()
+    for chunk in _chunked(rows, chunk_size):
+        # ON CONFLICT DO UPDATE cannot touch the same row twice in one statement, so the last row wins
+        latest: dict[Any, tuple[int, Mapping[str, Any]]] = {}
+        for index, row in chunk:
+            previous = latest.get(row[conflict_field])
+            if previous is not None:
+                result.conflicts.append(BulkConflict(index=previous[0], field=conflict_field))
+            latest[row[conflict_field]] = (index, row)
+        unique_rows = sorted(latest.values(), key=lambda item: item[0])
+
+        existing = set((await session.scalars(select(conflict_column).where(conflict_column.in_(list(latest))))).all())
+        try:
+            async with session.begin_nested():
+                upserted = await _upsert(session, model, [row for _, row in unique_rows], conflict_field, on_update)
+        except IntegrityError:
+            # Some rows collide on another unique field, retry them one by one to isolate those
+            upserted = []
+            failed = []
+            for index, row in unique_rows:
+                try:
+                    async with session.begin_nested():
+                        upserted.extend(await _upsert(session, model, [row], conflict_field, on_update))
+                except IntegrityError:
+                    failed.append((index, row))
+            result.conflicts.extend(
+                await _find_conflicts(
+                    session, model, failed, [name for name in unique_fields if name != conflict_field]
+                )
+            )
+
+        for obj in upserted:
+            (result.updated if getattr(obj, conflict_field) in existing else result.created).append(obj)
+    result.conflicts.sort(key=lambda conflict: conflict.index)
+    return result
+
+
+async def _upsert[T: Base](
+    session: AsyncSession,
+    model: type[T],
+    rows: list[Mapping[str, Any]],
+    conflict_field: str,
+    on_update: Callable[[ColumnCollection], Mapping[str, Any]] | None,
+) -> list[T]:
+    stmt = dialect_insert(session, model).values(rows)
+    set_ = {name: stmt.excluded[name] for name in rows[0] if name != conflict_field}
+    if on_update is not None:
+        set_.update(on_update(stmt.excluded))
+    stmt = stmt.on_conflict_do_update(index_elements=[conflict_field], set_=set_)
+    scalars = await session.scalars(stmt.returning(model), execution_options={"populate_existing": True})
+    return list(scalars.all())
@@ -0,0 +1,85 @@
+__all__ = ["UniqueViolationError", "translate_unique_violation", "unique_violation_field"]
+
+import re
+from collections.abc import Iterator
+from contextlib import contextmanager
+from functools import cache
+
+from sqlalchemy import UniqueConstraint
+from sqlalchemy.exc import IntegrityError
+
+from src.db.models import Base
+
+_SQLITE_UNIQUE_RE = re.compile(r"UNIQUE constraint failed: (?P<columns>[\w.]+(?:, [\w.]+)*)")
+
+
+class UniqueViolationError(Exception):
+    """
+    A write collided with an existing row on a unique column.
+    """
+
+    field: str
+    "Name of the unique column"
+
+    def __init__(self, model: type[Base], field: str) -> None:
+        super().__init__(f"{model.__name__}.{field} already in use")
+        self.field = field
+
+
+@cache
+def _unique_constraints(model: type[Base]) -> dict[str, str]:
+    """
+    Map names of single-column unique indexes and constraints of the model table to their column.
+    """
+    table = model.__table__
+    names: dict[str, str] = {}
+    for index in table.indexes:
+        if index.unique and len(index.columns) == 1 and index.name:
+            names[index.name] = next(iter(index.columns)).key
+    for constraint in table.constraints:
+        if isinstance(constraint, UniqueConstraint) and len(constraint.columns) == 1 and constraint.name:
+            names[constraint.name] = next(iter(constraint.columns)).key
+    return names
+
+
+def _constraint_name(error: IntegrityError) -> str | None:
+    orig = error.orig
+    # asyncpg wraps the original exception, psycopg exposes the diagnostics directly
+    for source in (getattr(orig, "__cause__", None), orig):
+        name = getattr(source, "constraint_name", None)
+        if name:
+            return name
+    diag = getattr(orig, "diag", None)
+    return getattr(diag, "constraint_name", None)
+
+
+def unique_violation_field(error: IntegrityError, model: type[Base]) -> str | None:
+    """
+    Name of the unique column of `model` the error was raised for, None if it is not a unique violation on it.
+    """
+    constraint_name = _constraint_name(error)
+    if constraint_name is not None:
+        return _unique_constraints(model).get(constraint_name)
+
+    # SQLite does not report constraint names, only the offending columns
+    match = _SQLITE_UNIQUE_RE.search(str(error.orig))
+    if match is None:
+        return None
+    table_name, _, column = match["columns"].split(", ")[0].rpartition(".")
+    if table_name != model.__tablename__ or column not in model.__table__.columns:
+        return None
+    return column
+
+
+@contextmanager
+def translate_unique_violation(model: type[Base]) -> Iterator[None]:
+    """
+    Re-raise unique violations on `model` columns as `UniqueViolationError`, other integrity errors as they are.
+    """
+    try:
+        yield
+    except IntegrityError as e:
+        field = unique_violation_field(e, model)
+        if field is None:
+            raise
+        raise UniqueViolationError(model, field) from e
@@ -0,0 +1,122 @@
+__all__ = ["INVALIDATION_CHANNEL", "InvalidationListener", "publish_invalidation"]
+
+import asyncio
+import contextlib
+import json
+import logging
+from collections.abc import Hashable, Sequence
+from typing import Any
+
+from sqlalchemy import event, func, select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from src import cache
+
+logger = logging.getLogger("src")
+
+INVALIDATION_CHANNEL = "cache_invalidation"
+"Postgres channel the cache keys changed by a committed transaction are sent on"
+
+_KEYS_PER_NOTIFICATION = 500
+"Keeps payloads well below the 8000 bytes limit of NOTIFY"
+
+_PENDING_INVALIDATIONS = "pending_invalidations"
+"`Session.info` key of the cache keys to evict from this process once the session commits"
+
+
+def _evict_pending(session: Session) -> None:
+    pending = session.info.get(_PENDING_INVALIDATIONS)
+    while pending:
+        namespace, key = pending.pop()
+        cache.invalidate(namespace, key)
+
+
+async def publish_invalidation(session: AsyncSession, namespace: str, keys: Sequence[Hashable]) -> None:
+    """
+    Evict `keys` from the caches of this process and, on Postgres, notify the other processes, both once the
+    session commits. Evicting earlier would let a concurrent request cache the row as it was before the commit.
+    Notifications are transactional: they are only delivered once the session commits, after the change is visible.
+    """
+    pending = session.info.setdefault(_PENDING_INVALIDATIONS, set())
+    pending.update((namespace, key) for key in keys)
+    if not event.contains(session.sync_session, "after_commit", _evict_pending):
+        event.listen(session.sync_session, "after_commit", _evict_pending)
+    if not keys or session.bind.dialect.name != "postgresql":
+        return
+    for start in range(0, len(keys), _KEYS_PER_NOTIFICATION):
+        payload = json.dumps({"namespace": namespace, "keys": list(keys[start : start + _KEYS_PER_NOTIFICATION])})
+        await session.execute(select(func.pg_notify(INVALIDATION_CHANNEL, payload)))
+
+
+class InvalidationListener:
+    """
+    Listen for invalidations published by other processes on a dedicated connection and evict the keys from
+    the caches of this process. Notifications sent while the connection is down are lost, so all caches are
+    cleared whenever it (re)connects.
+    """
+
+    dsn: str
+    check_interval: float
+
+    def __init__(self, url: str, check_interval: float = 30.0) -> None:
+        # asyncpg does not understand SQLAlchemy driver names
+        self.dsn = make_url(url).set(drivername="postgresql").render_as_string(hide_password=False)
+        self.check_interval = check_interval
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await self._task
+        self._task = None
+
+    async def _run(self) -> None:
+        import asyncpg  # noqa: PLC0415
+
+        while True:
+            try:
+                connection = await asyncpg.connect(self.dsn, timeout=self.check_interval)
+            except (OSError, TimeoutError, asyncpg.PostgresError) as e:
+                logger.warning(f"Cache invalidation listener could not connect: {e!r}")
+                await asyncio.sleep(self.check_interval)
+                continue
+            try:
+                await connection.add_listener(INVALIDATION_CHANNEL, self._on_notification)
+                cache.clear()
+                await self._watch(connection)
+            except (OSError, TimeoutError, asyncpg.PostgresError, asyncpg.InterfaceError) as e:
+                logger.warning(f"Cache invalidation listener lost its connection: {e!r}")
+            finally:
+                connection.terminate()
+
+    async def _watch(self, connection: Any) -> None:
+        """
+        Raise once the connection is closed or stops answering.
+        """
+        closed = asyncio.Event()
+        connection.add_termination_listener(lambda _: closed.set())
+        while not closed.is_set():
+            with contextlib.suppress(TimeoutError):
+                await asyncio.wait_for(closed.wait(), timeout=self.check_interval)
+            if not closed.is_set():
+                await asyncio.wait_for(connection.fetchval("SELECT 1"), timeout=self.check_interval)
+        raise ConnectionError("connection closed")
+
+    def _on_notification(self, _connection: Any, _pid: int, _channel: str, payload: str) -> None:
+        try:
+            message = json.loads(payload)
+            namespace, keys = message["namespace"], message["keys"]
+        except (ValueError, KeyError, TypeError):
+            logger.warning(f"Malformed cache invalidation {payload!r}, clearing all caches")
+            cache.clear()
+            return
+        for key in keys:
+            cache.invalidate(namespace, key)
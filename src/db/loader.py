@@ -0,0 +1,108 @@
+__all__ = ["BatchLoader", "ids_filter"]
+
+import asyncio
+import contextlib
+from collections.abc import Awaitable, Callable, Hashable, Mapping, Sequence
+
+from sqlalchemy import ColumnElement, any_, literal
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import InstrumentedAttribute
+
+from src import metrics
+
+_BATCH_SIZE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+def ids_filter(session: AsyncSession, column: InstrumentedAttribute, ids: Sequence[Hashable]) -> ColumnElement[bool]:
+    """
+    `column IN ids`. On Postgres it is `column = ANY(:ids)` with one array parameter, so every batch size shares
+    one prepared statement.
+    """
+    if session.bind.dialect.name == "postgresql":
+        return column == any_(literal(list(ids), ARRAY(column.type)))
+    return column.in_(ids)
+
+
+class BatchLoader[K: Hashable, V]:
+    """
+    Collect the keys requested within `window` seconds, or within one event loop iteration if it is 0, and load
+    them with a single `load_many` call, then hand each caller its value (None if it was not found).
+
+    A loader bound to a request session must not run batches concurrently, `max_concurrent_batches=1` makes keys
+    requested while a batch is running wait for the next one.
+    """
+
+    name: str
+    window: float
+    max_batch_size: int
+
+    def __init__(
+        self,
+        name: str,
+        load_many: Callable[[list[K]], Awaitable[Mapping[K, V]]],
+        *,
+        window: float = 0.0,
+        max_batch_size: int = 1000,
+        max_concurrent_batches: int | None = None,
+    ) -> None:
+        self.name = name
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self._load_many = load_many
+        self._pending: dict[K, list[asyncio.Future[V | None]]] = {}
+        self._scheduled: asyncio.Handle | None = None
+        self._running: set[asyncio.Task] = set()
+        self._semaphore = asyncio.Semaphore(max_concurrent_batches) if max_concurrent_batches else None
+
+        self.batch_sizes = metrics.histogram(
+            f"loader.{name}.batch_size", _BATCH_SIZE_BUCKETS, "Number of distinct keys loaded by one query"
+        )
+        self.requested = metrics.counter(f"loader.{name}.requested", "Keys requested from the loader")
+
+    async def load(self, key: K) -> V | None:
+        loop = asyncio.get_running_loop()
+        future: asyncio.Future[V | None] = loop.create_future()
+        self._pending.setdefault(key, []).append(future)
+        self.requested.inc()
+
+        if len(self._pending) >= self.max_batch_size:
+            self._dispatch()
+        elif self._scheduled is None:
+            if self.window > 0:
+                self._scheduled = loop.call_later(self.window, self._dispatch)
+            else:
+                self._scheduled = loop.call_soon(self._dispatch)
+        return await future
+
+    async def load_many(self, keys: Sequence[K]) -> list[V | None]:
+        return list(await asyncio.gather(*(self.load(key) for key in keys)))
+
+    def _dispatch(self) -> None:
+        if self._scheduled is not None:
+            self._scheduled.cancel()
+            self._scheduled = None
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        task = asyncio.create_task(self._run(batch))
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    async def _run(self, batch: dict[K, list[asyncio.Future[V | None]]]) -> None:
+        async with self._semaphore or contextlib.nullcontext():
+            self.batch_sizes.observe(len(batch))
+            try:
+                values = await self._load_many(list(batch))
+            except Exception as e:
+                for futures in batch.values():
+                    for future in futures:
+                        if not future.done():
+                            future.set_exception(e)
+                return
+
+        for key, futures in batch.items():
+            value = values.get(key)
+            for future in futures:
+                if not future.done():
+                    future.set_result(value)
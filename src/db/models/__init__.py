@@ -1,8 +1,12 @@
 from src.db.models.base import Base  # noqa: I001
 
 from src.db.models.user import User
+from src.db.models.refresh_token import RefreshToken
+from src.db.models.rate_limit_bucket import RateLimitBucket
 
 __all__ = [
     'Base',
     'User',
+    'RefreshToken',
+    'RateLimitBucket',
 ]
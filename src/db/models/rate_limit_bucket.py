@@ -0,0 +1,19 @@
+from __future__ import annotations
+
+from sqlalchemy.orm import Mapped, mapped_column
+
+from src.db.models import Base
+
+
+class RateLimitBucket(Base):
+    """
+    Token bucket shared by all workers, for the `database` rate limit store.
+    """
+
+    __tablename__ = "rate_limit_bucket"
+
+    key: Mapped[str] = mapped_column(primary_key=True)
+    tokens: Mapped[float]
+    "Tokens left at `updated_at`"
+    updated_at: Mapped[float] = mapped_column(index=True)
+    "Unix time of the last request that took tokens"
@@ -0,0 +1,26 @@
+from __future__ import annotations
+
+from datetime import datetime
+
+from sqlalchemy import DateTime, ForeignKey, false
+from sqlalchemy.orm import Mapped, mapped_column
+
+from src.db.models import Base
+
+
+class RefreshToken(Base):
+    """
+    Issued refresh token. Every refresh uses up the presented token and issues the next one of its family, so a
+    token presented twice means it was stolen and the whole family is revoked.
+    """
+
+    __tablename__ = "refresh_token"
+
+    jti: Mapped[str] = mapped_column(primary_key=True)
+    family_id: Mapped[str] = mapped_column(index=True)
+    "Shared by all tokens rotated from the same login"
+    user_id: Mapped[int] = mapped_column(ForeignKey("user.id", ondelete="CASCADE"), index=True)
+    expires_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), index=True)
+    used_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True))
+    "When the token was exchanged for the next one"
+    revoked: Mapped[bool] = mapped_column(default=False, server_default=false())
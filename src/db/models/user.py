@@ -16,3 +16,5 @@ class User(Base):
     hashed_password: Mapped[str]
 
     is_admin: Mapped[bool]
+    token_version: Mapped[int] = mapped_column(default=0, server_default="0")
+    "Bumped when the password changes (`revoke_tokens`), tokens issued for an older version are rejected"
@@ -0,0 +1,75 @@
+__all__ = ["InvalidCursorError", "Page", "keyset", "make_page"]
+
+import base64
+import binascii
+import json
+from collections.abc import Sequence
+from dataclasses import dataclass
+from typing import Any
+
+from sqlalchemy import Select
+from sqlalchemy.orm import InstrumentedAttribute
+
+
+class InvalidCursorError(ValueError):
+    pass
+
+
+@dataclass
+class Page[T]:
+    items: list[T]
+    next_cursor: str | None
+    "Opaque cursor of the next page, None on the last page"
+
+
+def _encode_cursor(sort_key: str, descending: bool, value: Any) -> str:
+    raw = json.dumps([sort_key, descending, value], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str, sort_column: InstrumentedAttribute, descending: bool) -> Any:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        cursor_sort_key, cursor_descending, value = json.loads(raw)
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError) as e:
+        raise InvalidCursorError("Malformed cursor") from e
+    if cursor_sort_key != sort_column.key or cursor_descending != descending:
+        raise InvalidCursorError("Cursor was issued for another sort order")
+    try:
+        python_type = sort_column.type.python_type
+    except NotImplementedError:
+        return value
+    # JSON has no separate float and bool types, and bool is a subclass of int
+    expected_type = (int, float) if python_type is float else python_type
+    if not isinstance(value, expected_type) or isinstance(value, bool) != (python_type is bool):
+        raise InvalidCursorError("Cursor value does not match the sort column")
+    return value
+
+
+def keyset(
+    stmt: Select,
+    sort_column: InstrumentedAttribute,
+    *,
+    limit: int,
+    cursor: str | None = None,
+    descending: bool = False,
+) -> Select:
+    """
+    Restrict `stmt` to the page after `cursor` using a seek on `sort_column` instead of OFFSET, so every page
+    costs one index range scan. The column must be unique, it is the only thing the cursor remembers.
+    One extra row is fetched to tell whether there is a next page, pass the rows to `make_page`.
+    """
+    if cursor is not None:
+        after = _decode_cursor(cursor, sort_column, descending)
+        stmt = stmt.where(sort_column < after if descending else sort_column > after)
+    return stmt.order_by(sort_column.desc() if descending else sort_column.asc()).limit(limit + 1)
+
+
+def make_page[T](
+    rows: Sequence[T], sort_column: InstrumentedAttribute, *, limit: int, descending: bool = False
+) -> Page[T]:
+    items = list(rows[:limit])
+    if len(rows) <= limit:
+        return Page(items=items, next_cursor=None)
+    last_value = getattr(items[-1], sort_column.key)
+    return Page(items=items, next_cursor=_encode_cursor(sort_column.key, descending, last_value))
@@ -0,0 +1,21 @@
+__all__ = ["project"]
+
+from functools import cache
+
+from pydantic import BaseModel
+from sqlalchemy.orm import InstrumentedAttribute
+
+from src.db.models import Base
+
+
+@cache
+def project(model: type[Base], schema: type[BaseModel]) -> tuple[InstrumentedAttribute, ...]:
+    """
+    Columns of `model` needed to validate `schema` from attributes, to select rows instead of whole entities.
+    Every schema field must map to a column of the same name.
+    """
+    columns = model.__table__.columns
+    missing = [name for name in schema.model_fields if name not in columns]
+    if missing:
+        raise ValueError(f"{schema.__name__} fields {missing} are not columns of {model.__name__}")
+    return tuple(getattr(model, name) for name in schema.model_fields)
@@ -0,0 +1,85 @@
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from typing import Self
+
+from sqlalchemy import case, delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.db import AbstractSQLAlchemyStorage
+from src.db.bulk import dialect_insert
+from src.db.models import RateLimitBucket
+from src.db.storage import PRIMARY_PINNED
+
+
+class RateLimitRepository:
+    storage: AbstractSQLAlchemyStorage
+    session: AsyncSession | None
+
+    def __init__(self, storage: AbstractSQLAlchemyStorage, session: AsyncSession | None = None) -> None:
+        self.storage = storage
+        self.session = session
+
+    def update_storage(self, storage: AbstractSQLAlchemyStorage) -> Self:
+        self.storage = storage
+        return self
+
+    def _create_session(self) -> AsyncSession:
+        return self.storage.create_write_session()
+
+    @asynccontextmanager
+    async def _session(self) -> AsyncIterator[AsyncSession]:
+        """
+        Yield the request-scoped session if the repository is bound to one, changes are only flushed and
+        committed by the session owner. Otherwise, yield a short-lived session committed on exit.
+        """
+        if self.session is not None:
+            self.session.info[PRIMARY_PINNED] = True
+            yield self.session
+            await self.session.flush()
+        else:
+            async with self._create_session() as session:
+                yield session
+                await session.commit()
+
+    async def take_tokens(
+        self, key: str, cost: float, capacity: float, refill_per_second: float, now: float
+    ) -> float | None:
+        """
+        Take `cost` tokens from the bucket, after refilling it for the time since its last request, with one
+        INSERT ... ON CONFLICT DO UPDATE round trip. The update only applies if enough tokens are left, so concurrent
+        requests of all workers can never overdraw the bucket.
+        Returns the tokens left, None if there were not enough and none were taken.
+        """
+        if cost > capacity:
+            return None
+        elapsed = case((RateLimitBucket.updated_at < now, now - RateLimitBucket.updated_at), else_=0)
+        refilled = RateLimitBucket.tokens + elapsed * refill_per_second
+        refilled = case((refilled > capacity, capacity), else_=refilled)
+        async with self._session() as session:
+            stmt = (
+                dialect_insert(session, RateLimitBucket)
+                .values(key=key, tokens=capacity - cost, updated_at=now)
+                .on_conflict_do_update(
+                    index_elements=[RateLimitBucket.key],
+                    set_={"tokens": refilled - cost, "updated_at": now},
+                    where=refilled >= cost,
+                )
+                .returning(RateLimitBucket.tokens)
+            )
+            return await session.scalar(stmt)
+
+    async def delete_idle_buckets(self, before: float, batch_size: int = 1000) -> int:
+        """
+        Delete up to `batch_size` buckets without requests since `before`, by then they are full again.
+        Returns the number of deleted buckets.
+        """
+        idle = (
+            select(RateLimitBucket.key).where(RateLimitBucket.updated_at < before).limit(batch_size)
+        ).scalar_subquery()
+        async with self._session() as session:
+            result = await session.execute(
+                delete(RateLimitBucket)
+                .where(RateLimitBucket.key.in_(idle))
+                .execution_options(synchronize_session=False)
+            )
+            return result.rowcount
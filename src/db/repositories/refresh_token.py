@@ -0,0 +1,125 @@
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from datetime import UTC, datetime
+from typing import Self
+
+from sqlalchemy import delete, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.db import AbstractSQLAlchemyStorage
+from src.db.models import RefreshToken
+from src.db.storage import PRIMARY_PINNED
+
+
+class RefreshTokenRepository:
+    """
+    Issued refresh tokens. Every query goes to the primary: a token must be seen as used or revoked by the very
+    next refresh, which a lagging replica cannot guarantee.
+    """
+
+    storage: AbstractSQLAlchemyStorage
+    session: AsyncSession | None
+
+    def __init__(self, storage: AbstractSQLAlchemyStorage, session: AsyncSession | None = None) -> None:
+        self.storage = storage
+        self.session = session
+
+    def update_storage(self, storage: AbstractSQLAlchemyStorage) -> Self:
+        self.storage = storage
+        return self
+
+    def _create_session(self) -> AsyncSession:
+        return self.storage.create_write_session()
+
+    @asynccontextmanager
+    async def _session(self) -> AsyncIterator[AsyncSession]:
+        """
+        Yield the request-scoped session if the repository is bound to one, changes are only flushed and
+        committed by the session owner. Otherwise, yield a short-lived session committed on exit.
+        """
+        if self.session is not None:
+            self.session.info[PRIMARY_PINNED] = True
+            yield self.session
+            await self.session.flush()
+        else:
+            async with self._create_session() as session:
+                yield session
+                await session.commit()
+
+    async def create_refresh_token(self, jti: str, family_id: str, user_id: int, expires_at: datetime) -> RefreshToken:
+        async with self._session() as session:
+            refresh_token = RefreshToken(jti=jti, family_id=family_id, user_id=user_id, expires_at=expires_at)
+            session.add(refresh_token)
+            return refresh_token
+
+    async def get_refresh_token(self, jti: str) -> RefreshToken | None:
+        async with self._session() as session:
+            return await session.get(RefreshToken, jti)
+
+    async def rotate_refresh_token(self, jti: str, new_jti: str, expires_at: datetime) -> RefreshToken | None:
+        """
+        Use up the token and issue the next one of its family. Marking the token used is a single conditional
+        UPDATE, so of two concurrent refreshes with the same token only one succeeds.
+        Returns None if the token is unknown, expired, revoked or already used.
+        """
+        now = datetime.now(UTC)
+        async with self._session() as session:
+            result = await session.execute(
+                update(RefreshToken)
+                .where(
+                    RefreshToken.jti == jti,
+                    RefreshToken.used_at.is_(None),
+                    RefreshToken.revoked.is_(False),
+                    RefreshToken.expires_at > now,
+                )
+                .values(used_at=now)
+                .returning(RefreshToken.family_id, RefreshToken.user_id)
+                .execution_options(synchronize_session=False)
+            )
+            current = result.one_or_none()
+            if current is None:
+                return None
+            refresh_token = RefreshToken(
+                jti=new_jti, family_id=current.family_id, user_id=current.user_id, expires_at=expires_at
+            )
+            session.add(refresh_token)
+            return refresh_token
+
+    async def revoke_refresh_token_family(self, family_id: str) -> int:
+        """
+        Revoke all tokens of the family. Returns the number of revoked tokens.
+        """
+        async with self._session() as session:
+            result = await session.execute(
+                update(RefreshToken)
+                .where(RefreshToken.family_id == family_id)
+                .values(revoked=True)
+                .execution_options(synchronize_session=False)
+            )
+            return result.rowcount
+
+    async def list_revoked_families(self) -> list[str]:
+        """
+        Ids of the revoked families that still have unexpired tokens.
+        """
+        async with self._session() as session:
+            result = await session.scalars(
+                select(RefreshToken.family_id)
+                .where(RefreshToken.revoked.is_(True), RefreshToken.expires_at > datetime.now(UTC))
+                .distinct()
+            )
+            return list(result.all())
+
+    async def delete_expired_refresh_tokens(self, batch_size: int = 1000) -> int:
+        """
+        Delete up to `batch_size` expired tokens, so that a large backlog does not hold locks for long.
+        Returns the number of deleted tokens.
+        """
+        expired = (
+            select(RefreshToken.jti).where(RefreshToken.expires_at <= datetime.now(UTC)).limit(batch_size)
+        ).scalar_subquery()
+        async with self._session() as session:
+            result = await session.execute(
+                delete(RefreshToken).where(RefreshToken.jti.in_(expired)).execution_options(synchronize_session=False)
+            )
+            return result.rowcount
@@ -1,50 +1,181 @@
-from typing import Self
+from collections.abc import AsyncIterator, Mapping, Sequence
+from contextlib import asynccontextmanager
+from typing import Any, Literal, Self
 
-from sqlalchemy import select
+from pydantic import BaseModel
+from sqlalchemy import ColumnCollection, Row, case, delete, select, update
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.db import AbstractSQLAlchemyStorage
+from src.db.bulk import DEFAULT_CHUNK_SIZE, BulkResult, bulk_insert, bulk_upsert
+from src.db.errors import translate_unique_violation
+from src.db.invalidation import publish_invalidation
+from src.db.loader import BatchLoader, ids_filter
 from src.db.models import User
+from src.db.pagination import Page, keyset, make_page
+from src.db.projection import project
+from src.db.singleflight import single_flight
+from src.db.storage import PRIMARY_PINNED
+
+UserSortKey = Literal["id", "username", "email"]
+"Unique indexed columns users can be listed by"
+
+
+def _bump_token_version(excluded: ColumnCollection) -> dict[str, Any]:
+    # Hashes are salted, so a row upserted with a freshly hashed password always counts as a password change
+    changed = case((User.hashed_password != excluded.hashed_password, 1), else_=0)
+    return {"token_version": User.token_version + changed}
 
 
 class UserRepository:
     storage: AbstractSQLAlchemyStorage
+    session: AsyncSession | None
+    read_session: AsyncSession | None
 
-    def __init__(self, storage: AbstractSQLAlchemyStorage) -> None:
+    def __init__(
+        self,
+        storage: AbstractSQLAlchemyStorage,
+        session: AsyncSession | None = None,
+        read_session: AsyncSession | None = None,
+    ) -> None:
         self.storage = storage
+        self.session = session
+        self.read_session = read_session
 
     def update_storage(self, storage: AbstractSQLAlchemyStorage) -> Self:
         self.storage = storage
         return self
 
     def _create_session(self) -> AsyncSession:
-        return self.storage.create_session()
+        return self.storage.create_write_session()
+
+    @asynccontextmanager
+    async def _session(self) -> AsyncIterator[AsyncSession]:
+        """
+        Yield the request-scoped session if the repository is bound to one, changes are only flushed and
+        committed by the session owner. Otherwise, yield a short-lived session committed on exit.
+        """
+        if self.session is not None:
+            self.session.info[PRIMARY_PINNED] = True
+            yield self.session
+            await self.session.flush()
+        else:
+            async with self._create_session() as session:
+                yield session
+                await session.commit()
+
+    @asynccontextmanager
+    async def _read_session(self) -> AsyncIterator[AsyncSession]:
+        """
+        Yield a session for read-only queries: the request-scoped read session, or the request session once the
+        request has written, so it reads its own writes from the primary. Otherwise, yield a short-lived one.
+        """
+        if self.session is not None and (self.read_session is None or self.session.info.get(PRIMARY_PINNED)):
+            yield self.session
+        elif self.read_session is not None:
+            yield self.read_session
+        else:
+            async with self.storage.create_read_session() as session:
+                yield session
 
     async def create_user(self, name: str, username: str, email: str, hashed_password: str, is_admin: bool = False) -> User:
-        async with self._create_session() as session:
-            user = User(
-                name=name,
-                username=username,
-                email=email,
-                hashed_password=hashed_password,
-                is_admin=is_admin,
+        """
+        Raises `UniqueViolationError` if the email or username is already in use.
+        """
+        with translate_unique_violation(User):
+            async with self._session() as session:
+                user = User(
+                    name=name,
+                    username=username,
+                    email=email,
+                    hashed_password=hashed_password,
+                    is_admin=is_admin,
+                )
+                session.add(user)
+                return user
+
+    async def create_users_bulk(
+        self, users: Sequence[Mapping[str, Any]], chunk_size: int = DEFAULT_CHUNK_SIZE
+    ) -> BulkResult[User]:
+        """
+        Create users from mappings of `create_user` arguments, a few statements per `chunk_size` users.
+        Users taking an already used email or username are skipped and reported as conflicts.
+        """
+        rows = [{"is_admin": False, **user} for user in users]
+        async with self._session() as session:
+            return await bulk_insert(session, User, rows, unique_fields=("email", "username"), chunk_size=chunk_size)
+
+    async def upsert_users(
+        self,
+        users: Sequence[Mapping[str, Any]],
+        conflict_field: Literal["email", "username"] = "email",
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+    ) -> BulkResult[User]:
+        """
+        Create users or update the existing ones with the same `conflict_field`.
+        Users taking the other unique field of another user are reported as conflicts. Updating the password
+        bumps `token_version`, like `edit_user` with `revoke_tokens`.
+        """
+        rows = [{"is_admin": False, **user} for user in users]
+        async with self._session() as session:
+            result = await bulk_upsert(
+                session,
+                User,
+                rows,
+                conflict_field,
+                unique_fields=("email", "username"),
+                chunk_size=chunk_size,
+                on_update=_bump_token_version if rows and "hashed_password" in rows[0] else None,
             )
-            session.add(user)
-            await session.commit()
-            return user
+            await publish_invalidation(session, User.__tablename__, [user.id for user in result.updated])
+            return result
 
+    @single_flight
     async def get_user(self, user_id: int) -> User | None:
-        async with self._create_session() as session:
+        async with self._read_session() as session:
             user = await session.get(User, user_id)
             return user
 
+    async def get_users_by_ids(self, user_ids: Sequence[int]) -> dict[int, User]:
+        async with self._read_session() as session:
+            result = await session.scalars(select(User).where(ids_filter(session, User.id, user_ids)))
+            return {user.id: user for user in result}
+
+    def create_user_loader(
+        self, window: float = 0.0, max_batch_size: int = 1000, max_concurrent_batches: int | None = None
+    ) -> BatchLoader[int, User]:
+        """
+        Loader batching concurrent `get_user`-style lookups into one `get_users_by_ids` query.
+        If the repository is bound to a request session, batches run one at a time.
+        """
+        if self.session is not None:
+            max_concurrent_batches = 1
+        return BatchLoader(
+            User.__tablename__,
+            self.get_users_by_ids,
+            window=window,
+            max_batch_size=max_batch_size,
+            max_concurrent_batches=max_concurrent_batches,
+        )
+
+    @single_flight
+    async def get_user_projected(self, user_id: int, schema: type[BaseModel]) -> Row | None:
+        """
+        Read only the columns `schema` needs, as a row that can be validated with `schema.model_validate`.
+        """
+        async with self._read_session() as session:
+            result = await session.execute(select(*project(User, schema)).where(User.id == user_id))
+            return result.one_or_none()
+
+    @single_flight
     async def get_user_by_email(self, email: str) -> User | None:
-        async with self._create_session() as session:
+        async with self._read_session() as session:
             result = await session.execute(select(User).where(User.email == email))
             return result.scalar_one_or_none()
 
+    @single_flight
     async def get_user_by_username(self, username: str) -> User | None:
-        async with self._create_session() as session:
+        async with self._read_session() as session:
             result = await session.execute(select(User).where(User.username == username))
             return result.scalar_one_or_none()
 
@@ -57,36 +188,104 @@ class UserRepository:
         email: str | None = None,
         hashed_password: str | None = None,
         is_admin: bool | None = None,
+        revoke_tokens: bool = False,
     ) -> User | None:
-        async with self._create_session() as session:
-            user = await session.get(User, user_id)
-            if user is None:
-                return None
-
-            if name is not None:
-                user.name = name
-            if username is not None:
-                user.username = username
-            if email is not None:
-                user.email = email
-            if hashed_password is not None:
-                user.hashed_password = hashed_password
-            if is_admin is not None:
-                user.is_admin = is_admin
-
-            await session.commit()
-            return user
+        """
+        Returns None if there is no such user. Raises `UniqueViolationError` if the new email or username is taken.
+        Passing `revoke_tokens` bumps `token_version`, invalidating the issued tokens. Role changes do not: the
+        role is read from the user on every check and refresh, and stateless principals expire with their tokens.
+        """
+        values: dict[str, Any] = {
+            key: value
+            for key, value in (
+                ("name", name),
+                ("username", username),
+                ("email", email),
+                ("hashed_password", hashed_password),
+                ("is_admin", is_admin),
+            )
+            if value is not None
+        }
+        if revoke_tokens:
+            values["token_version"] = User.token_version + 1
+        with translate_unique_violation(User):
+            async with self._session() as session:
+                if not values:
+                    return await session.get(User, user_id)
+                # One UPDATE ... RETURNING round trip, no rows means there is no such user
+                result = await session.scalars(
+                    update(User).where(User.id == user_id).values(values).returning(User),
+                    execution_options={"populate_existing": True},
+                )
+                await publish_invalidation(session, User.__tablename__, [user_id])
+                return result.one_or_none()
 
-    async def delete_user(self, user_id: int) -> User | None:
-        async with self._create_session() as session:
-            user = await session.get(User, user_id)
-            if user is None:
-                return None
-            await session.delete(user)
-            await session.commit()
-            return user
+    async def delete_user(self, user_id: int) -> int | None:
+        """
+        Delete the user with one DELETE ... RETURNING round trip. Returns the id of the deleted user,
+        None if there is no such user.
+        """
+        async with self._session() as session:
+            deleted_id = await session.scalar(delete(User).where(User.id == user_id).returning(User.id))
+            if deleted_id is not None:
+                await publish_invalidation(session, User.__tablename__, [deleted_id])
+            return deleted_id
+
+    async def list_users(
+        self,
+        *,
+        limit: int = 50,
+        cursor: str | None = None,
+        sort: UserSortKey = "id",
+        descending: bool = False,
+    ) -> Page[User]:
+        sort_column = getattr(User, sort)
+        async with self._read_session() as session:
+            result = await session.scalars(
+                keyset(select(User), sort_column, limit=limit, cursor=cursor, descending=descending)
+            )
+            return make_page(result.all(), sort_column, limit=limit, descending=descending)
 
-    async def list_users(self) -> list[User]:
-        async with self._create_session() as session:
-            result = await session.execute(select(User))
-            return list(result.scalars().all())
+    async def list_users_projected(
+        self,
+        schema: type[BaseModel],
+        *,
+        limit: int = 50,
+        cursor: str | None = None,
+        sort: UserSortKey = "id",
+        descending: bool = False,
+    ) -> Page[Row]:
+        """
+        Same as `list_users`, but read only the columns `schema` needs as rows instead of entities.
+        """
+        sort_column = getattr(User, sort)
+        columns = project(User, schema)
+        if sort not in schema.model_fields:
+            # The cursor is built from the sort column of the last row
+            columns = (*columns, sort_column)
+        async with self._read_session() as session:
+            result = await session.execute(
+                keyset(select(*columns), sort_column, limit=limit, cursor=cursor, descending=descending)
+            )
+            return make_page(result.all(), sort_column, limit=limit, descending=descending)
+
+    async def stream_users(
+        self,
+        schema: type[BaseModel],
+        *,
+        sort: UserSortKey = "id",
+        descending: bool = False,
+        batch_size: int = 1000,
+    ) -> AsyncIterator[Row]:
+        """
+        Iterate over all users as rows with the columns `schema` needs, fetched from a server-side cursor
+        `batch_size` rows at a time.
+        Uses its own read session, so it can be consumed after the request session is closed, e.g. by a
+        `StreamingResponse`.
+        """
+        sort_column = getattr(User, sort)
+        stmt = select(*project(User, schema)).order_by(sort_column.desc() if descending else sort_column.asc())
+        async with self.storage.create_read_session() as session:
+            result = await session.stream(stmt.execution_options(yield_per=batch_size))
+            async for row in result:
+                yield row
@@ -0,0 +1,102 @@
+__all__ = ["configure", "single_flight"]
+
+import asyncio
+import functools
+from collections.abc import Awaitable, Callable, Hashable, Mapping
+from types import SimpleNamespace
+from typing import Any
+
+from sqlalchemy import inspect
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import InstanceState
+
+from src import metrics
+from src.db.storage import PRIMARY_PINNED
+
+_config = SimpleNamespace(enabled=True, overrides={})
+_in_flight: dict[Hashable, asyncio.Future] = {}
+
+
+def configure(enabled: bool = True, overrides: Mapping[str, bool] | None = None) -> None:
+    """
+    Turn coalescing on or off, for all methods or per method by its `Class.method` name.
+    """
+    _config.enabled = enabled
+    _config.overrides = dict(overrides or {})
+
+
+def _is_enabled(name: str) -> bool:
+    return _config.overrides.get(name, _config.enabled)
+
+
+def _retrieve_exception(future: asyncio.Future) -> None:
+    # Nobody may be left waiting, e.g. when the call failed without anybody joining it
+    if not future.cancelled():
+        future.exception()
+
+
+async def _adopt[T](result: T, session: AsyncSession) -> T:
+    """
+    Copy an ORM instance loaded by another session into `session`, without a query. Other results, e.g. rows,
+    are immutable and returned as they are.
+    """
+    if not isinstance(inspect(result, raiseerr=False), InstanceState):
+        return result
+    return await session.merge(result, load=False)
+
+
+def single_flight[T](method: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[T]]:
+    """
+    Make concurrent calls of a repository read method with the same arguments share one query and its result.
+
+    The first call runs on its own repository and session as usual. Calls arriving while it is in flight wait for
+    it and get copies of the loaded instances in their own request session, so no extra session is opened and no
+    instance is shared between requests. If the first call is cancelled, the waiting calls run the query
+    themselves. Calls of a repository whose request has already written go straight to its session, to read their
+    own writes; calls of a repository without a request session never wait for others.
+    """
+    name = method.__qualname__
+    coalesced = metrics.counter(f"single_flight.{name}.coalesced", "Calls that joined an identical in-flight call")
+
+    @functools.wraps(method)
+    async def wrapper(self: Any, *args: Any, **kwargs: Any) -> T:
+        if not _is_enabled(name) or (self.session is not None and self.session.info.get(PRIMARY_PINNED)):
+            return await method(self, *args, **kwargs)
+        try:
+            key = (name, id(self.storage), args, frozenset(kwargs.items()))
+            future = _in_flight.get(key)
+        except TypeError:
+            # Unhashable arguments cannot be compared, just run the call
+            return await method(self, *args, **kwargs)
+
+        session = self.read_session if self.read_session is not None else self.session
+        if future is not None:
+            if session is not None:
+                try:
+                    result = await asyncio.shield(future)
+                except asyncio.CancelledError:
+                    if not future.cancelled():
+                        raise
+                else:
+                    coalesced.inc()
+                    return await _adopt(result, session)
+            # The first call was cancelled, or there is no session to copy its result into
+            return await method(self, *args, **kwargs)
+
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(_retrieve_exception)
+        _in_flight[key] = future
+        try:
+            result = await method(self, *args, **kwargs)
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del _in_flight[key]
+            if not future.done():
+                future.cancel()
+
+    return wrapper
@@ -1,14 +1,45 @@
-__all__ = ["SQLAlchemyStorage", "AbstractSQLAlchemyStorage"]
+__all__ = [
+    "PRIMARY_PINNED",
+    "AbstractSQLAlchemyStorage",
+    "Replica",
+    "ReplicaBalancing",
+    "SQLAlchemyStorage",
+    "SQLiteStorage",
+]
 
+import asyncio
+import importlib.util
+import itertools
+import time
+import uuid
 from abc import ABC, abstractmethod
+from collections.abc import Sequence
+from typing import Any, Literal
 
+from sqlalchemy import event, text
+from sqlalchemy.engine import ExceptionContext
 from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker
 
+ReplicaBalancing = Literal["round_robin", "least_busy"]
+
+PRIMARY_PINNED = "primary_pinned"
+"Key in `AsyncSession.info` set once a request session has written, reads of that request then go to the primary"
+
 
 class AbstractSQLAlchemyStorage(ABC):
     @abstractmethod
     def create_session(self) -> AsyncSession: ...
 
+    def create_write_session(self) -> AsyncSession:
+        return self.create_session()
+
+    def create_read_session(self) -> AsyncSession:
+        return self.create_session()
+
+    @property
+    def has_replicas(self) -> bool:
+        return False
+
     @abstractmethod
     async def create_all(self) -> None: ...
 
@@ -16,20 +47,213 @@ class AbstractSQLAlchemyStorage(ABC):
     async def close_connection(self): ...
 
 
+class Replica:
+    engine: AsyncEngine
+    sessionmaker: async_sessionmaker
+    in_use: int
+    "Number of connections currently checked out from the replica pool"
+    unhealthy_until: float
+    "Monotonic time until which the replica is skipped"
+
+    def __init__(self, engine: AsyncEngine, retry_after: float) -> None:
+        self.engine = engine
+        self.sessionmaker = async_sessionmaker(expire_on_commit=False, bind=self.engine)
+        self.in_use = 0
+        self.unhealthy_until = 0.0
+        self.retry_after = retry_after
+
+        event.listen(engine.sync_engine, "checkout", self._on_checkout)
+        event.listen(engine.sync_engine, "checkin", self._on_checkin)
+        event.listen(engine.sync_engine, "handle_error", self._on_error)
+
+    @property
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.unhealthy_until
+
+    def mark_unhealthy(self) -> None:
+        self.unhealthy_until = time.monotonic() + self.retry_after
+
+    def mark_healthy(self) -> None:
+        self.unhealthy_until = 0.0
+
+    def _on_checkout(self, *_: Any) -> None:
+        self.in_use += 1
+
+    def _on_checkin(self, *_: Any) -> None:
+        self.in_use = max(0, self.in_use - 1)
+
+    def _on_error(self, context: ExceptionContext) -> None:
+        if context.is_disconnect:
+            self.mark_unhealthy()
+
+
 class SQLAlchemyStorage(AbstractSQLAlchemyStorage):
+    engine: AsyncEngine
+    sessionmaker: async_sessionmaker
+    replicas: list[Replica]
+    balancing: ReplicaBalancing
+
+    def __init__(
+        self,
+        engine: AsyncEngine,
+        replicas: Sequence[Replica] = (),
+        balancing: ReplicaBalancing = "round_robin",
+    ) -> None:
+        self.engine = engine
+        self.sessionmaker = async_sessionmaker(expire_on_commit=False, bind=self.engine)
+        self.replicas = list(replicas)
+        self.balancing = balancing
+        self._round_robin = itertools.count()
+        self._health_check_task: asyncio.Task | None = None
+
+    @classmethod
+    def from_url(
+        cls,
+        url: str,
+        replica_urls: Sequence[str] = (),
+        balancing: ReplicaBalancing = "round_robin",
+        replica_retry_after: float = 30.0,
+        **engine_kwargs: Any,
+    ) -> "SQLAlchemyStorage":
+        from sqlalchemy.ext.asyncio import create_async_engine  # noqa: PLC0415
+
+        engine = create_async_engine(url, **engine_kwargs)
+        replicas = [
+            Replica(create_async_engine(replica_url, **engine_kwargs), retry_after=replica_retry_after)
+            for replica_url in replica_urls
+        ]
+        return cls(engine, replicas, balancing)
+
+    def create_session(self) -> AsyncSession:
+        return self.sessionmaker()
+
+    def create_write_session(self) -> AsyncSession:
+        return self.sessionmaker()
+
+    def create_read_session(self) -> AsyncSession:
+        replica = self._choose_replica()
+        if replica is None:
+            # No healthy replicas, fall back to the primary
+            return self.sessionmaker()
+        return replica.sessionmaker()
+
+    @property
+    def has_replicas(self) -> bool:
+        return bool(self.replicas)
+
+    def _choose_replica(self) -> Replica | None:
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        if not healthy:
+            return None
+        if self.balancing == "least_busy":
+            return min(healthy, key=lambda replica: replica.in_use)
+        return healthy[next(self._round_robin) % len(healthy)]
+
+    async def check_replicas(self, timeout: float = 5.0) -> None:
+        """
+        Probe every replica with a trivial query and update its health.
+        """
+        for replica in self.replicas:
+            try:
+                async with asyncio.timeout(timeout), replica.engine.connect() as conn:
+                    await conn.execute(text("SELECT 1"))
+            except Exception:
+                replica.mark_unhealthy()
+            else:
+                replica.mark_healthy()
+
+    def start_replica_health_checks(self, interval: float) -> None:
+        if not self.replicas or self._health_check_task is not None:
+            return
+
+        async def run() -> None:
+            while True:
+                await self.check_replicas()
+                await asyncio.sleep(interval)
+
+        self._health_check_task = asyncio.create_task(run())
+
+    async def create_all(self) -> None:
+        from src.db.models import Base  # noqa: PLC0415
+
+        async with self.engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+    async def drop_all(self) -> None:
+        from src.db.models import Base  # noqa: PLC0415
+
+        async with self.engine.begin() as conn:
+            await conn.run_sync(Base.metadata.drop_all)
+
+    async def close_connection(self):
+        if self._health_check_task is not None:
+            self._health_check_task.cancel()
+            self._health_check_task = None
+        for replica in self.replicas:
+            await replica.engine.dispose()
+        await self.engine.dispose()
+
+
+class SQLiteStorage(AbstractSQLAlchemyStorage):
+    """
+    Storage backed by aiosqlite, for benchmarks and tests that should run without Postgres.
+    Requires the `sqlite` extra: `uv sync --extra sqlite`.
+    """
+
     engine: AsyncEngine
     sessionmaker: async_sessionmaker
 
-    def __init__(self, engine: AsyncEngine) -> None:
+    def __init__(self, engine: AsyncEngine, keep_alive: Any = None) -> None:
         self.engine = engine
         self.sessionmaker = async_sessionmaker(expire_on_commit=False, bind=self.engine)
+        self._keep_alive = keep_alive
+        "Connection keeping an in-memory database alive, whatever happens to the pooled one"
 
     @classmethod
-    def from_url(cls, url: str) -> "SQLAlchemyStorage":
+    def from_url(cls, url: str, shared_connection: bool | None = None) -> "SQLiteStorage":
+        """
+        Create storage for a `sqlite+aiosqlite://` URL. An in-memory database always uses a single connection,
+        file databases may opt in to it. Sessions take turns on that connection: each one holds it from its first
+        query to the end of its transaction, as SQLite connections cannot keep transactions apart.
+        """
+        import sqlite3  # noqa: PLC0415
+
+        from sqlalchemy.engine import make_url  # noqa: PLC0415
         from sqlalchemy.ext.asyncio import create_async_engine  # noqa: PLC0415
+        from sqlalchemy.pool import AsyncAdaptedQueuePool  # noqa: PLC0415
+
+        if importlib.util.find_spec("aiosqlite") is None:
+            raise RuntimeError("SQLite storage requires `aiosqlite`, install it with `uv sync --extra sqlite`")
+
+        in_memory = make_url(url).database in (None, "", ":memory:")
+        keep_alive = None
+        engine_kwargs: dict[str, Any] = {}
+        if in_memory:
+            # A named database shared by the connections of this process, it lives as long as one of them is open
+            name = f"file:memory-{uuid.uuid4().hex}?mode=memory&cache=shared"
+            keep_alive = sqlite3.connect(name, uri=True, check_same_thread=False)
+            url = f"sqlite+aiosqlite:///{name}&uri=true"
+        if in_memory or shared_connection:
+            engine_kwargs.update(poolclass=AsyncAdaptedQueuePool, pool_size=1, max_overflow=0)
+        engine = create_async_engine(url, connect_args={"check_same_thread": False}, **engine_kwargs)
+
+        @event.listens_for(engine.sync_engine, "connect")
+        def _set_pragmas(dbapi_connection: Any, _: Any) -> None:
+            cursor = dbapi_connection.cursor()
+            cursor.execute("PRAGMA foreign_keys=ON")
+            if not in_memory:
+                cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.close()
 
-        engine = create_async_engine(url)
-        return cls(engine)
+        return cls(engine, keep_alive)
+
+    @classmethod
+    def in_memory(cls) -> "SQLiteStorage":
+        return cls.from_url("sqlite+aiosqlite://")
+
+    @classmethod
+    def from_path(cls, path: str, shared_connection: bool = False) -> "SQLiteStorage":
+        return cls.from_url(f"sqlite+aiosqlite:///{path}", shared_connection=shared_connection)
 
     def create_session(self) -> AsyncSession:
         return self.sessionmaker()
@@ -48,3 +272,6 @@ class SQLAlchemyStorage(AbstractSQLAlchemyStorage):
 
     async def close_connection(self):
         await self.engine.dispose()
+        if self._keep_alive is not None:
+            self._keep_alive.close()
+            self._keep_alive = None
@@ -0,0 +1,111 @@
+__all__ = ["Counter", "Gauge", "Histogram", "counter", "gauge", "histogram", "snapshot"]
+
+import bisect
+from collections.abc import Callable, Sequence
+from typing import Any
+
+
+class Counter:
+    name: str
+    description: str
+    value: int
+
+    def __init__(self, name: str, description: str = "") -> None:
+        self.name = name
+        self.description = description
+        self.value = 0
+
+    def inc(self, amount: int = 1) -> None:
+        self.value += amount
+
+    def collect(self) -> Any:
+        return self.value
+
+
+class Gauge:
+    """
+    Value read from a callback when metrics are collected.
+    """
+
+    name: str
+    description: str
+
+    def __init__(self, name: str, read: Callable[[], float], description: str = "") -> None:
+        self.name = name
+        self.description = description
+        self._read = read
+
+    def collect(self) -> Any:
+        return self._read()
+
+
+class Histogram:
+    """
+    Distribution of observed values over fixed buckets, each counting the values above the previous bound up to its own.
+    """
+
+    name: str
+    description: str
+    buckets: tuple[float, ...]
+
+    def __init__(self, name: str, buckets: Sequence[float], description: str = "") -> None:
+        self.name = name
+        self.description = description
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self._counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def collect(self) -> Any:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "buckets": {
+                **{f"le_{bound:g}": count for bound, count in zip(self.buckets, self._counts, strict=False)},
+                "le_inf": self._counts[-1],
+            },
+        }
+
+
+_registry: dict[str, Counter | Gauge | Histogram] = {}
+
+
+def counter(name: str, description: str = "") -> Counter:
+    """
+    Get the counter registered under `name`, registering a new one on first use.
+    """
+    metric = _registry.get(name)
+    if metric is None:
+        metric = _registry[name] = Counter(name, description)
+    if not isinstance(metric, Counter):
+        raise TypeError(f"Metric {name} is not a counter")
+    return metric
+
+
+def gauge(name: str, read: Callable[[], float], description: str = "") -> Gauge:
+    """
+    Register a gauge under `name`, replacing the previous one.
+    """
+    metric = _registry[name] = Gauge(name, read, description)
+    return metric
+
+
+def histogram(name: str, buckets: Sequence[float], description: str = "") -> Histogram:
+    """
+    Get the histogram registered under `name`, registering a new one on first use.
+    """
+    metric = _registry.get(name)
+    if metric is None:
+        metric = _registry[name] = Histogram(name, buckets, description)
+    if not isinstance(metric, Histogram):
+        raise TypeError(f"Metric {name} is not a histogram")
+    return metric
+
+
+def snapshot() -> dict[str, Any]:
+    return {name: metric.collect() for name, metric in sorted(_registry.items())}
@@ -1,12 +1,18 @@
 from src.schemas.auth import LoginRequest, RefreshTokenRequest, RegisterRequest, TokenPayload, TokenResponse
-from src.schemas.user import UserCreate, UserResponse
+from src.schemas.bulk import BulkConflictResponse
+from src.schemas.pagination import PageResponse
+from src.schemas.user import UserBulkCreate, UserBulkResponse, UserCreate, UserResponse
 
 __all__ = [
+    'BulkConflictResponse',
     'LoginRequest',
+    'PageResponse',
     'RefreshTokenRequest',
     'RegisterRequest',
     'TokenPayload',
     'TokenResponse',
+    'UserBulkCreate',
+    'UserBulkResponse',
     'UserCreate',
     'UserResponse',
 ]
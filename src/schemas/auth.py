@@ -13,6 +13,14 @@ class TokenPayload(BaseSchema):
     iat: int  # NumericDate
     nbf: int | None = None  # NumericDate
     type: TokenType
+    scope: str | None = None
+    "Space-delimited scopes"
+    token_version: int = 0
+    "`User.token_version` at the time the token was issued"
+    jti: str | None = None
+    "Unique id of a refresh token"
+    fam: str | None = None
+    "Family of a refresh token, shared by all tokens rotated from the same login"
 
 
 class TokenResponse(BaseSchema):
@@ -0,0 +1,12 @@
+from pydantic import ConfigDict
+
+from src.schemas.pydantic_base import BaseSchema
+
+
+class BulkConflictResponse(BaseSchema):
+    index: int
+    "Position of the item in the request"
+    field: str | None
+    "Unique field the item conflicts on, null if it was rejected for another reason"
+
+    model_config = ConfigDict(from_attributes=True)
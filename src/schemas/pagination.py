@@ -0,0 +1,7 @@
+from src.schemas.pydantic_base import BaseSchema
+
+
+class PageResponse[T](BaseSchema):
+    items: list[T]
+    next_cursor: str | None
+    "Pass as `cursor` to get the next page, null on the last page"
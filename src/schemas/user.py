@@ -1,5 +1,8 @@
-from pydantic import ConfigDict, EmailStr
+from typing import Literal
 
+from pydantic import ConfigDict, EmailStr, Field
+
+from src.schemas.bulk import BulkConflictResponse
 from src.schemas.pydantic_base import BaseSchema
 
 
@@ -19,3 +22,15 @@ class UserResponse(BaseSchema):
     is_admin: bool
 
     model_config = ConfigDict(from_attributes=True)
+
+
+class UserBulkCreate(BaseSchema):
+    users: list[UserCreate] = Field(..., min_length=1, max_length=10_000)
+    upsert_on: Literal["email", "username"] | None = None
+    "Update existing users with the same email or username instead of reporting them as conflicts"
+
+
+class UserBulkResponse(BaseSchema):
+    created: list[UserResponse]
+    updated: list[UserResponse]
+    conflicts: list[BulkConflictResponse]